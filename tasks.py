@@ -5,8 +5,6 @@ from pathlib import Path
 from invoke import Collection, Executor
 from tools.tasks import git, dev, odoo, docker
 
-from tools.env_settings import fsonline_env
-
 
 # Logging setup
 # -------------
@@ -56,8 +54,10 @@ namespace.add_collection(dev)
 namespace.add_collection(git)
 namespace.add_collection(odoo)
 namespace.add_collection(docker)
+# ATTENTION: 'fsonline_env_settings' is resolved on first access by the tasks (see fsonline_env_settings()) so
+#            that 'invoke --list' and the shell completion do not load pydantic and the settings
 namespace.configure({
     'root_namespace': namespace,
     'invoke_execute': invoke_execute,
-    'fsonline_env_settings': fsonline_env(),
+    'fsonline_env_settings': None,
 })
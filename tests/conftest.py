@@ -0,0 +1,137 @@
+import os
+import shutil
+import subprocess
+import tempfile
+from pathlib import Path
+import pytest
+from invoke import Config, Context
+from tools.env_settings import Conventions, use_conventions
+
+# Memory backed temp directories make the file system heavy tests fast. Falls back to the default temp dir.
+TMPFS_DIR = Path('/dev/shm')
+
+# Environment variables of the settings that would leak into the tests
+SETTINGS_ENV_PREFIXES = ('FSONLINE_', 'CORE_', 'INST_', 'GIT_MIRROR_DIR')
+
+
+def _manifest(path: Path, depends=()):
+    path.mkdir(parents=True)
+    (path / '__manifest__.py').write_text(repr({'name': path.name, 'depends': list(depends)}))
+
+
+def build_core_tree(core_dir: Path):
+    """ A core repository with a fake odoo (OCB) and two third party addons """
+    (core_dir / '.git').mkdir(parents=True)
+    (core_dir / 'core.env').write_text(
+        'CORE_ODOO_SRC="src/OCA/OCB"\n'
+        'CORE_ADDON_SRC=\'["src/DADI/addons/*", "src/OCA/web/*"]\'\n'
+        'CORE_ADDONS_TO_INSTALL=\'["dadi_base"]\'\n'
+        'INST_ADDON_SRC=\'[]\'\n')
+    ocb = core_dir / 'src' / 'OCA' / 'OCB'
+    _manifest(ocb / 'odoo' / 'addons' / 'base')
+    _manifest(ocb / 'addons' / 'web', ['base'])
+    _manifest(ocb / 'addons' / 'mail', ['base'])
+    (ocb / 'odoo' / 'addons' / '__init__.py').write_text('')
+    (ocb / 'odoo' / '__init__.py').write_text('')
+    (ocb / 'odoo-bin').write_text('')
+    _manifest(core_dir / 'src' / 'OCA' / 'web' / 'web_widget', ['web'])
+    _manifest(core_dir / 'src' / 'DADI' / 'addons' / 'dadi_base', ['web_widget'])
+
+
+def build_instance_tree(inst_dir: Path) -> Path:
+    """ An instance repository with the core repository in inst_dir/core. Returns the core directory. """
+    (inst_dir / '.git').mkdir(parents=True)
+    (inst_dir / 'inst.env').write_text(
+        'INST_ADDON_SRC=\'["src/addons/*"]\'\n'
+        'INST_ADDONS_TO_INSTALL=\'["inst_addon"]\'\n')
+    _manifest(inst_dir / 'src' / 'addons' / 'inst_addon', ['dadi_base'])
+    build_core_tree(inst_dir / 'core')
+    return inst_dir / 'core'
+
+
+@pytest.fixture
+def tmpfs_path(tmp_path):
+    """ A temporary directory on tmpfs if available, else tmp_path """
+    if not (TMPFS_DIR.is_dir() and os.access(TMPFS_DIR, os.W_OK)):
+        yield tmp_path
+        return
+    path = Path(tempfile.mkdtemp(prefix='fsonline-test-', dir=TMPFS_DIR))
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+@pytest.fixture
+def clean_environ(monkeypatch):
+    """ Remove all settings from os.environ and disable the settings cache """
+    for key in list(os.environ):
+        if key.startswith(SETTINGS_ENV_PREFIXES):
+            monkeypatch.delenv(key)
+    monkeypatch.setenv('FSONLINE_ENV_CACHE', '0')
+
+
+@pytest.fixture
+def core_tree(tmpfs_path, clean_environ) -> Conventions:
+    """ A disposable core repository. conventions() points to it during the test. """
+    build_core_tree(tmpfs_path / 'core')
+    with use_conventions(tmpfs_path / 'core') as cov:
+        yield cov
+
+
+@pytest.fixture
+def instance_tree(tmpfs_path, clean_environ) -> Conventions:
+    """ A disposable instance repository with its core repository. conventions() points to it during the test. """
+    with use_conventions(build_instance_tree(tmpfs_path / 'inst')) as cov:
+        yield cov
+
+
+@pytest.fixture
+def invoke_context() -> Context:
+    """ A real invoke context like the one of tasks.py. The settings are resolved on first access. """
+    return Context(Config(overrides={'fsonline_env_settings': None}))
+
+
+def git(cwd: Path, *args):
+    """ Run git in cwd, fail on errors """
+    subprocess.run(['git', '-C', str(cwd), *args], check=True, capture_output=True)
+
+
+@pytest.fixture
+def git_env(monkeypatch):
+    """ A git identity for commits and local file submodules """
+    for key, value in (('GIT_AUTHOR_NAME', 'test'), ('GIT_AUTHOR_EMAIL', 'test@example.com'),
+                       ('GIT_COMMITTER_NAME', 'test'), ('GIT_COMMITTER_EMAIL', 'test@example.com'),
+                       ('GIT_CONFIG_COUNT', '1'), ('GIT_CONFIG_KEY_0', 'protocol.file.allow'),
+                       ('GIT_CONFIG_VALUE_0', 'always')):
+        monkeypatch.setenv(key, value)
+
+
+@pytest.fixture
+def superproject(tmp_path, git_env):
+    """ A superproject with two submodules cloned from local bare repositories """
+
+    upstream = tmp_path / 'upstream'
+    for name in ('web', 'project'):
+        work = upstream / f"{name}.work"
+        work.mkdir(parents=True)
+        git(work, 'init', '-q', '-b', '14.0')
+        for addon, depends in (('web_addon', []), ('web_unused', []), ('project_addon', ['web_addon', 'base'])):
+            if addon.startswith(name):
+                (work / addon).mkdir()
+                (work / addon / '__manifest__.py').write_text(repr({'depends': depends}))
+        git(work, 'add', '-A')
+        git(work, 'commit', '-q', '-m', 'init')
+        git(upstream, 'clone', '-q', '--bare', str(work), f"{name}.git")
+
+    repo = tmp_path / 'repo'
+    repo.mkdir()
+    git(repo, 'init', '-q')
+    for name in ('web', 'project'):
+        git(repo, 'submodule', 'add', '-q', '-b', '14.0', str(upstream / f"{name}.git"), f"src/OCA/{name}")
+    git(repo, 'commit', '-q', '-m', 'submodules')
+
+    # A fresh clone has the submodules registered but not initialized
+    clone = tmp_path / 'clone'
+    git(tmp_path, 'clone', '-q', str(repo), str(clone))
+    return clone
@@ -0,0 +1,35 @@
+import pytest
+from tools.addon_graph import AddonGraph, AddonCycleError
+
+
+def test_addon_graph():
+    graph = AddonGraph({
+        'base': [],
+        'web': ['base'],
+        'mail': ['base', 'web'],
+        'project': ['mail'],
+        'crm': ['mail', 'missing'],
+        'unused': ['web'],
+    })
+    assert graph.closure(['project']) == {'project', 'mail', 'web', 'base'}
+    assert graph.install_order(['project', 'crm']) == ['base', 'missing', 'web', 'mail', 'crm', 'project']
+    assert graph.topological_order(['crm', 'project', 'web']) == ['crm', 'project', 'web']
+    assert graph.reverse_closure(['web']) == {'web', 'mail', 'project', 'crm', 'unused'}
+    assert graph.missing() == {'missing'}
+    assert graph.find_cycle() is None
+
+
+def test_addon_graph_cycle():
+    graph = AddonGraph({'a': ['b'], 'b': ['c'], 'c': ['a'], 'd': []})
+    assert graph.find_cycle() == ['a', 'b', 'c', 'a']
+    with pytest.raises(AddonCycleError) as e:
+        graph.topological_order()
+    assert e.value.cycle == ['a', 'b', 'c', 'a']
+
+
+def test_addon_graph_large():
+    # A long dependency chain must not hit the recursion limit
+    graph = AddonGraph({f"a{i}": [f"a{i - 1}"] if i else [] for i in range(20000)})
+    assert len(graph.closure(['a19999'])) == 20000
+    assert graph.install_order(['a19999'])[:2] == ['a0', 'a1']
+    assert graph.find_cycle() is None
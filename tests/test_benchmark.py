@@ -0,0 +1,35 @@
+from tools.addon_graph import AddonGraph
+from tools.benchmark import generate_tree, benchmark_tree, run_benchmarks, compare_results
+from tools.manifest import addon_manifests
+
+
+def test_generate_tree(tmp_path):
+    addon_dirs = generate_tree(tmp_path, 30, roots=3, seed=1)
+    assert len(addon_dirs) == 30
+    assert len({d.parent for d in addon_dirs}) == 3
+    assert (tmp_path / 'src' / 'OCA' / 'OCB' / 'odoo' / 'addons' / 'base' / '__manifest__.py').is_file()
+
+    graph = AddonGraph.from_manifests(addon_manifests(addon_dirs))
+    # Random but acyclic and reproducible
+    assert len(graph.topological_order()) == 30
+    assert graph.missing() == {'base'}
+    again = generate_tree(tmp_path / 'again', 30, roots=3, seed=1)
+    assert AddonGraph.from_manifests(addon_manifests(again)).depends == graph.depends
+
+
+def test_run_benchmarks(tmp_path):
+    results = run_benchmarks([20], repeat=1, work_dir=tmp_path)
+    benchmarks = {r['benchmark'] for r in results['results']}
+    assert {'find_addons', 'merge_env_files', 'fsonline_env', 'symlink_odoo', 'copier_post_processing'} <= benchmarks
+    assert all(r['addons'] == 20 and len(r['runs']) == 1 for r in results['results'])
+
+    slower = {**results, 'results': [{**r, 'median': r['median'] * 2} for r in results['results']]}
+    lines = compare_results(results, slower)
+    assert len(lines) == len(benchmarks) and all(line.endswith('REGRESSION') for line in lines)
+
+
+def test_benchmark_tree_roots(tmp_path):
+    # The benchmarks search the roots of the tree, not the default number of roots
+    addon_dirs = generate_tree(tmp_path / 'core', 40, roots=20, copier_sample=1)
+    results = benchmark_tree(tmp_path / 'core', addon_dirs, repeat=1)
+    assert {r.addons for r in results} == {40}
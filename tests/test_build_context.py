@@ -0,0 +1,89 @@
+import io
+import os
+import tarfile
+from tools.build_context import context_dockerfile
+from tools.tasks.docker import build
+from tools.layers import order_groups, LayerGroup
+
+
+def test_build_context(core_tree, invoke_context, tmp_path):
+    # Symlinks in the sources are resolved
+    ocb = core_tree.core_dir / 'src' / 'OCA' / 'OCB'
+    (ocb / 'odoo' / 'release.py').write_text('version = 14')
+    (ocb / 'odoo' / 'release_link.py').symlink_to('release.py')
+    # No repository metadata
+    (ocb / '.git' / 'objects').mkdir(parents=True)
+    (ocb / '.git' / 'objects' / 'pack.pack').write_text('')
+    (ocb / '.github').mkdir()
+    (ocb / '.github' / 'ci.yml').write_text('')
+    dockerfile = tmp_path / 'Dockerfile'
+    dockerfile.write_text('FROM scratch\n')
+
+    context = tmp_path / 'context.tar'
+    written = build(invoke_context, dockerfile=str(dockerfile), output=str(context), prune=True, layers='single',
+                    precompile='none')
+    with tarfile.open(context) as tar:
+        members = {m.name: m for m in tar.getmembers()}
+        assert sorted(members) == [
+            'Dockerfile', 'fsonline/odoo-bin', 'fsonline/odoo/__init__.py', 'fsonline/odoo/addons/__init__.py',
+            'fsonline/odoo/addons/base/__manifest__.py', 'fsonline/odoo/addons/dadi_base/__manifest__.py',
+            'fsonline/odoo/addons/web/__manifest__.py', 'fsonline/odoo/addons/web_widget/__manifest__.py',
+            'fsonline/odoo/release.py', 'fsonline/odoo/release_link.py']
+        assert all(m.isfile() and m.uid == 0 for m in members.values())
+        assert tar.extractfile('fsonline/odoo/release_link.py').read() == b'version = 14'
+        assert tar.extractfile('Dockerfile').read().decode() == context_dockerfile('FROM scratch')
+    assert written == sum(m.size for name, m in members.items() if name != 'Dockerfile')
+
+
+def test_context_dockerfile():
+    dockerfile = context_dockerfile('FROM python:3.8-slim-buster AS odoo-os\nENTRYPOINT ["python3"]\n\n')
+    assert dockerfile.splitlines()[-1] == 'COPY fsonline/ /opt/odoo/'
+    assert io.StringIO(dockerfile).readline() == 'FROM python:3.8-slim-buster AS odoo-os\n'
+
+
+def test_build_streams_to_docker(core_tree, invoke_context, tmp_path, monkeypatch):
+    # A fake docker that lists the streamed context
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    (bin_dir / 'docker').write_text(f"#!/bin/sh\necho \"$@\" > {tmp_path}/args\ntar -t > {tmp_path}/names\n")
+    (bin_dir / 'docker').chmod(0o755)
+    monkeypatch.setenv('PATH', f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+    build(invoke_context, tag='test-image', prune=True)
+    assert (tmp_path / 'args').read_text() == 'build -t test-image -\n'
+    names = (tmp_path / 'names').read_text().splitlines()
+    assert names[0] == 'Dockerfile' and 'layers/02-core/odoo/addons/dadi_base/__manifest__.py' in names
+
+
+def test_layered_build_context(core_tree, invoke_context, tmp_path):
+    (core_tree.core_dir / '.gitmodules').write_text(
+        '[submodule "OCB"]\n\tpath = src/OCA/OCB\n\turl = https://github.com/OCA/OCB.git\n'
+        '[submodule "web"]\n\tpath = src/OCA/web\n\turl = https://github.com/OCA/web.git\n')
+    (core_tree.core_dir / 'src' / 'OCA' / 'OCB' / '.git').write_text('gitdir: ../../../.git/modules/src/OCA/OCB\n')
+    dockerfile = tmp_path / 'Dockerfile'
+    dockerfile.write_text('FROM scratch\n')
+    context = tmp_path / 'context.tar'
+    build(invoke_context, dockerfile=str(dockerfile), output=str(context), precompile='none')
+
+    with tarfile.open(context) as tar:
+        names = tar.getnames()
+        assert tar.extractfile('Dockerfile').read().decode().splitlines()[-4:] == [
+            'COPY layers/00-odoo/ /opt/odoo/',
+            'COPY layers/01-odoo-addons/ /opt/odoo/',
+            'COPY layers/02-src-oca-web/ /opt/odoo/',
+            'COPY layers/03-core/ /opt/odoo/']
+    assert sorted(names) == [
+        'Dockerfile', 'layers/00-odoo/odoo-bin', 'layers/00-odoo/odoo/__init__.py',
+        'layers/01-odoo-addons/odoo/addons/__init__.py', 'layers/01-odoo-addons/odoo/addons/base/__manifest__.py',
+        'layers/01-odoo-addons/odoo/addons/mail/__manifest__.py',
+        'layers/01-odoo-addons/odoo/addons/web/__manifest__.py',
+        'layers/02-src-oca-web/odoo/addons/web_widget/__manifest__.py',
+        'layers/03-core/odoo/addons/dadi_base/__manifest__.py']
+
+
+def test_order_groups(tmp_path, monkeypatch):
+    groups = [LayerGroup(name, tmp_path, [name], {}) for name in ('odoo', 'odoo-addons', 'a', 'b', 'c', 'core')]
+    churn = {'a': 5, 'b': 1, 'c': 5}
+    monkeypatch.setattr('tools.layers.git_churn', lambda repo_dir, paths, since: churn[paths[0]])
+    assert [g.name for g in order_groups(groups, order='churn')] == ['odoo', 'odoo-addons', 'b', 'a', 'c', 'core']
+    assert [g.name for g in order_groups(groups, max_layers=4)] == ['odoo', 'odoo-addons', 'a', 'b+c+core']
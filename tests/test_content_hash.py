@@ -0,0 +1,91 @@
+import os
+import subprocess
+import pytest
+from tools.content_hash import HashStore, list_tree, merkle_hash, repo_commit, ODOO_TREE
+from tools.tasks.docker import lock
+from invoke import Exit
+
+
+def test_tree_hashes(tmp_path):
+    for root in ('a', 'b'):
+        (tmp_path / root / 'models').mkdir(parents=True)
+        (tmp_path / root / 'models' / 'm.py').write_text('x = 1')
+        (tmp_path / root / '__init__.py').write_text('')
+        (tmp_path / root / '__pycache__').mkdir()
+        (tmp_path / root / '__pycache__' / 'm.cpython-311.pyc').write_text(root)
+    os.utime(tmp_path / 'b' / '__init__.py', ns=(1, 1))
+
+    store = HashStore(tmp_path / 'hashes.json')
+    trees = {'a': tmp_path / 'a', 'b': tmp_path / 'b'}
+    hashes = store.tree_hashes(trees, workers=2)
+    # Only the content and the relative paths count
+    assert hashes['a'] == hashes['b']
+    assert [f[0] for f in list_tree(tmp_path / 'a')] == ['__init__.py', 'models/m.py']
+
+    (tmp_path / 'b' / 'models' / 'm.py').write_text('x = 2')
+    assert store.tree_hashes(trees)['b'] != hashes['b']
+    (tmp_path / 'b' / 'models' / 'm.py').write_text('x = 1')
+    (tmp_path / 'b' / 'models' / 'm.py').chmod(0o755)
+    assert store.tree_hashes(trees)['b'] != hashes['b']
+    init_hash = store.file_hash(tmp_path / 'b' / '__init__.py')
+    assert store.tree_hashes(trees, exclude={'b': {'models'}})['b'] == merkle_hash([('__init__.py', f"f:{init_hash}")])
+
+    # Memoised by stat and cached in the file
+    store.save()
+    cached = HashStore(tmp_path / 'hashes.json')
+    (tmp_path / 'a' / '__init__.py').write_bytes(b'')
+    assert cached.tree_hashes({'a': tmp_path / 'a'}) == {'a': hashes['a']}
+
+
+def test_tree_hash_ignores_vcs_metadata(tmp_path):
+    for root in ('a', 'b'):
+        (tmp_path / root).mkdir()
+        (tmp_path / root / 'odoo-bin').write_text('')
+    # A submodule checkout has a .git file that points to the repository of the superproject
+    (tmp_path / 'b' / '.git').write_text('gitdir: ../../.git/modules/src/OCA/OCB\n')
+    (tmp_path / 'b' / '.gitignore').write_text('*.pyc\n')
+    (tmp_path / 'b' / '.github').mkdir()
+    (tmp_path / 'b' / '.github' / 'ci.yml').write_text('')
+    assert [f[0] for f in list_tree(tmp_path / 'b')] == ['odoo-bin']
+    hashes = HashStore().tree_hashes({'a': tmp_path / 'a', 'b': tmp_path / 'b'})
+    assert hashes['a'] == hashes['b']
+
+
+def test_lock_ignores_git_file(core_tree, invoke_context, capsys):
+    lock(invoke_context)
+    (core_tree.core_dir / 'src' / 'OCA' / 'OCB' / '.git').write_text('gitdir: ../../../.git/modules/src/OCA/OCB\n')
+    capsys.readouterr()
+    lock(invoke_context, check=True)
+    assert capsys.readouterr().out == ''
+
+
+def test_repo_commit(tmp_path):
+    subprocess.run(['git', 'init', '-q', str(tmp_path)], check=True)
+    subprocess.run(['git', '-C', str(tmp_path), '-c', 'user.name=t', '-c', 'user.email=t@t', 'commit', '-q',
+                    '--allow-empty', '-m', 'init'], check=True)
+    head = subprocess.run(['git', '-C', str(tmp_path), 'rev-parse', 'HEAD'], check=True, capture_output=True,
+                          text=True).stdout.strip()
+    (tmp_path / 'src' / 'addon').mkdir(parents=True)
+    cache = {}
+    assert repo_commit(tmp_path / 'src' / 'addon', cache) == head
+    assert cache[tmp_path / 'src'] == head
+
+
+def test_lock_task(core_tree, invoke_context, capsys):
+    entries = lock(invoke_context)
+    assert set(entries) == {ODOO_TREE, 'base', 'web', 'mail', 'web_widget', 'dadi_base'}
+    assert entries['dadi_base']['path'] == str(core_tree.core_dir / 'src' / 'DADI' / 'addons' / 'dadi_base')
+    assert core_tree.lock_file.is_file()
+    capsys.readouterr()
+
+    lock(invoke_context, check=True)
+    assert capsys.readouterr().out == ''
+
+    (core_tree.core_dir / 'src' / 'OCA' / 'OCB' / 'odoo-bin').write_text('#!/usr/bin/env python3')
+    with pytest.raises(Exit):
+        lock(invoke_context, check=True)
+    assert capsys.readouterr().out == 'odoo\n'
+    # Changes in the odoo addons do not change the odoo tree
+    (core_tree.core_dir / 'src' / 'OCA' / 'OCB' / 'addons' / 'mail' / '__init__.py').write_text('')
+    lock(invoke_context)
+    assert capsys.readouterr().out == 'mail\nodoo\n'
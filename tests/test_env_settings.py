@@ -1,40 +1,118 @@
-import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from tools.env_settings import conventions, fsonline_env
+import pytest
+from tools import env_settings
+from tools.env_settings import (
+    Conventions,
+    cached_fsonline_env,
+    conventions,
+    fsonline_env,
+    fsonline_envs,
+    use_conventions,
+)
 
 
-def test_environment_overrides():
-    os.environ.clear()
+def test_environment_overrides(core_tree, monkeypatch):
     # Default value for env
     settings = fsonline_env()
     assert settings.env == 'DEV'
 
     # From kwargs
-    os.environ.clear()
     settings = fsonline_env(env='STG')
     assert settings.env == 'STG'
 
     # From file
-    os.environ.clear()
-    core_override_file = Path(str(conventions().core_env_file) + '.local')
-    assert not core_override_file.exists(), "Local override File exists %s" % core_override_file
-    if not core_override_file.exists():
-        with open(core_override_file, mode="w") as of:
-            try:
-                of.write('FSONLINE_ENVIRONMENT="PRD"\nCORE_ODOO_SRC="tools/tests"')
-                of.seek(0)
-                settings = fsonline_env()
-                assert settings.env == 'PRD'
-                assert str(settings.core_odoo_src) == 'tools/tests'
-            except Exception as e:
-                raise e
-            finally:
-                of.close()
-                if core_override_file.exists():
-                    os.remove(core_override_file)
+    core_override_file = Path(str(core_tree.core_env_file) + '.local')
+    core_override_file.write_text('FSONLINE_ENVIRONMENT="PRD"\nCORE_ODOO_SRC="src/OCA/OCB/"')
+    settings = fsonline_env()
+    assert settings.env == 'PRD'
+    assert settings.core_odoo_dir == core_tree.core_dir / 'src' / 'OCA' / 'OCB'
 
     # From os environment
-    os.environ.clear()
-    os.environ["FSONLINE_ENVIRONMENT"] = 'STG'
+    monkeypatch.setenv("FSONLINE_ENVIRONMENT", 'STG')
     settings = fsonline_env()
     assert settings.env == 'STG'
+
+
+def test_instance_settings(instance_tree):
+    settings = fsonline_env()
+    assert settings.repo_dir == instance_tree.inst_dir
+    assert settings.core_dir == instance_tree.inst_dir / 'core'
+    assert [d.name for d in settings.addon_dirs()] == ['base', 'mail', 'web', 'dadi_base', 'web_widget', 'inst_addon']
+    assert settings.addons_to_install() == ['dadi_base', 'inst_addon']
+    assert settings.needed_addons() == {'base', 'web', 'web_widget', 'dadi_base', 'inst_addon'}
+
+
+def test_fsonline_envs(core_tree):
+    for env in ('stg', 'prd'):
+        Path(f"{core_tree.core_env_file}.{env}").write_text(f"CORE_ADDONS_TO_INSTALL='[\"{env}_addon\"]'\n")
+    envs = fsonline_envs()
+    assert list(envs) == ['DEV', 'STG', 'PRD']
+    assert {env: s.env for env, s in envs.items()} == {'DEV': 'DEV', 'STG': 'STG', 'PRD': 'PRD'}
+    assert [s.core_addons_to_install for s in envs.values()] == [['dadi_base'], ['stg_addon'], ['prd_addon']]
+    # Resolved in parallel, but every environment is resolved like on its own
+    assert envs['STG'] == fsonline_env(env='STG')
+
+
+def test_conventions_are_validated_on_access(tmp_path):
+    cov = Conventions(tmp_path)
+    # Nothing is checked before a location is used
+    assert cov.odoo_manifest_name == '__manifest__.py'
+    with pytest.raises(ValueError, match='core_env_file'):
+        cov.core_dir
+
+    (tmp_path / 'core.env').write_text('')
+    with pytest.raises(ValueError, match='.git'):
+        Conventions(tmp_path).repo_dir
+
+    (tmp_path / '.git').mkdir()
+    cov = Conventions(tmp_path)
+    assert cov.repo_dir == tmp_path
+    assert cov.inst_dir is None
+    assert cov.env_cache_file == tmp_path / '.cache' / 'fsonline_env.pickle'
+
+
+def test_use_conventions(tmp_path):
+    (tmp_path / 'core.env').write_text('')
+    (tmp_path / '.git').mkdir()
+    default = conventions()
+    with use_conventions(tmp_path) as cov:
+        assert conventions() is cov
+        assert conventions().core_dir == tmp_path
+        # Other threads keep their conventions
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            assert executor.submit(conventions).result() is default
+    assert conventions() is default
+
+
+def test_cached_fsonline_env(core_tree, monkeypatch, tmp_path):
+    monkeypatch.setenv('FSONLINE_ENV_CACHE', '1')
+    resolved = []
+    resolve = env_settings.fsonline_env
+    monkeypatch.setattr(env_settings, 'fsonline_env', lambda **kwargs: resolved.append(kwargs) or resolve(**kwargs))
+
+    settings = cached_fsonline_env()
+    assert core_tree.env_cache_file.read_bytes().startswith(b'fsonline-env-cache ')
+    assert cached_fsonline_env() == settings and len(resolved) == 1
+
+    # A changed env file
+    with open(core_tree.core_env_file, 'a') as f:
+        f.write('CORE_ADDONS_TO_INSTALL=\'["web"]\'\n')
+    assert cached_fsonline_env().core_addons_to_install == ['web'] and len(resolved) == 2
+
+    # A changed settings variable or a variable of a default
+    monkeypatch.setenv('CORE_ADDONS_TO_INSTALL', '["mail"]')
+    assert cached_fsonline_env().core_addons_to_install == ['mail'] and len(resolved) == 3
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+    assert cached_fsonline_env().git_mirror_dir == tmp_path / 'fsonline' / 'git-mirrors' and len(resolved) == 4
+    assert cached_fsonline_env() and len(resolved) == 4
+
+
+def test_cached_fsonline_env_rebuilds_broken_cache(core_tree, monkeypatch):
+    monkeypatch.setenv('FSONLINE_ENV_CACHE', '1')
+    settings = cached_fsonline_env()
+    header = core_tree.env_cache_file.read_bytes().split(b'\n', 1)[0]
+    # A pickle of a class that does not exist (anymore)
+    core_tree.env_cache_file.write_bytes(header + b'\n' + b'cno_such_module\nSettings\n.')
+    assert cached_fsonline_env() == settings
+    assert cached_fsonline_env() == settings
@@ -0,0 +1,88 @@
+import os
+import pytest
+from pathlib import Path
+from tools.helper import find_addons, plan_symlinks, plan_changes, execute_plan, merge_env_files
+
+
+def _make_addon(path: Path):
+    path.mkdir(parents=True)
+    (path / '__manifest__.py').write_text("{'name': '%s'}" % path.name)
+
+
+def test_find_addons_index(tmp_path):
+    _make_addon(tmp_path / 'src' / 'a' / 'addon_a')
+    _make_addon(tmp_path / 'src' / 'b' / 'addon_b')
+    (tmp_path / 'src' / 'a' / 'no_addon').mkdir()
+    index_file = tmp_path / 'index.json'
+    search_paths = [Path('src/a/*'), Path('src/b/*')]
+
+    addons = find_addons(search_paths, start_dir=tmp_path, index_file=index_file)
+    assert [a.name for a in addons] == ['addon_a', 'addon_b']
+    assert index_file.is_file()
+
+    # Unchanged roots are served from the index
+    os.remove(tmp_path / 'src' / 'b' / 'addon_b' / '__manifest__.py')
+    addons = find_addons(search_paths, start_dir=tmp_path, index_file=index_file)
+    assert [a.name for a in addons] == ['addon_a', 'addon_b']
+
+    # A changed root is scanned again
+    _make_addon(tmp_path / 'src' / 'b' / 'addon_c')
+    addons = find_addons(search_paths, start_dir=tmp_path, index_file=index_file)
+    assert [a.name for a in addons] == ['addon_a', 'addon_c']
+
+
+def test_find_addons_scandir(tmp_path):
+    for p in ('a/x/addon_1', 'a/y/addon_2', 'a/y/.hidden', 'b/addon_1'):
+        _make_addon(tmp_path / p)
+
+    addons = find_addons([Path('a/*/*')], start_dir=tmp_path, workers=2)
+    assert [a.name for a in addons] == ['addon_1', 'addon_2']
+
+    with pytest.raises(AssertionError):
+        find_addons([Path('a/*/*'), Path('b/*')], start_dir=tmp_path)
+
+
+def test_plan_symlinks_update(tmp_path):
+    src = tmp_path / 'src'
+    for name in ('a', 'b', 'c'):
+        (src / name).mkdir(parents=True)
+    tgt = tmp_path / 'tgt'
+
+    plan = plan_symlinks([tgt], {tgt / 'a': src / 'a', tgt / 'b': src / 'b'}, update=True)
+    assert [(op.op, op.path) for op in plan] == [('mkdir', tgt), ('symlink', tgt / 'a'), ('symlink', tgt / 'b')]
+    execute_plan(plan, batch_size=1)
+
+    plan = plan_symlinks([tgt], {tgt / 'a': src / 'a', tgt / 'b': src / 'c'}, update=True)
+    assert [(op.op, op.path) for op in plan] == [('mkdir', tgt), ('unlink', tgt / 'b'), ('symlink', tgt / 'b')]
+    execute_plan(plan)
+    assert os.readlink(tgt / 'b') == os.path.join('..', 'src', 'c')
+
+    plan = plan_symlinks([tgt], {tgt / 'b': src / 'c'}, update=True)
+    assert [(op.op, op.path) for op in plan] == [('mkdir', tgt), ('unlink', tgt / 'a')]
+    execute_plan(plan)
+    assert sorted(os.listdir(tgt)) == ['b']
+
+
+def test_plan_symlinks_skips_real_files(tmp_path):
+    src = tmp_path / 'src'
+    for name in ('a', 'b', 'c'):
+        (src / name).mkdir(parents=True)
+    tgt = tmp_path / 'tgt'
+    tgt.mkdir()
+    (tgt / 'a').write_text('own file')
+    (tgt / 'c').symlink_to(src / 'a')
+
+    plan = plan_symlinks([tgt], {tgt / 'a': src / 'a', tgt / 'b': src / 'b', tgt / 'c': src / 'c'}, update=True)
+    execute_plan(plan)
+    assert (tgt / 'a').read_text() == 'own file'
+    assert plan_changes(plan) == {'created': [tgt / 'b'], 'retargeted': [tgt / 'c'], 'removed': []}
+
+
+def test_merge_env_files(tmp_path):
+    core_env = tmp_path / 'core.env'
+    core_env.write_text("CORE_ODOO_SRC=\"src/OCA/OCB\"\nCORE_ADDON_SRC='[\n    \"src/a/*\"\n]'\n")
+    (tmp_path / 'core.env.local').write_text("CORE_ODOO_SRC=\"src/local\"\n")
+    (tmp_path / 'core.env.prd').write_text("CORE_ADDON_SRC='[]'\n")
+
+    assert merge_env_files('DEV', [core_env, None]) == {'CORE_ODOO_SRC': 'src/local', 'CORE_ADDON_SRC': ['src/a/*']}
+    assert merge_env_files('PRD', [core_env]) == {'CORE_ODOO_SRC': 'src/local', 'CORE_ADDON_SRC': []}
@@ -0,0 +1,75 @@
+import pytest
+from invoke import Exit
+from tools.impact import changed_files, owning_addons
+from tools.submodules import update_submodules
+from tools.tasks.git import changed_addons
+from .conftest import git
+
+
+def test_changed_files(superproject):
+    update_submodules(superproject)
+    web = superproject / 'src' / 'OCA' / 'web'
+    (web / 'web_addon' / 'new.py').write_text('')
+    git(web, 'add', '-A')
+    git(web, 'commit', '-q', '-m', 'change')
+    git(superproject, 'commit', '-q', '-am', 'bump web')
+
+    files = changed_files(superproject, 'HEAD~1')
+    assert files == [web / 'web_addon' / 'new.py']
+    addon_dirs = [web / 'web_addon', web / 'web_unused', superproject / 'src' / 'OCA' / 'project' / 'project_addon']
+    assert owning_addons(files, addon_dirs) == {'web_addon': files}
+
+
+def test_changed_files_nested_submodules(superproject, tmp_path):
+    update_submodules(superproject)
+    nested = tmp_path / 'nested'
+    nested.mkdir()
+    git(nested, 'init', '-q')
+    (nested / 'nested_addon').mkdir()
+    (nested / 'nested_addon' / '__manifest__.py').write_text('{}')
+    git(nested, 'add', '-A')
+    git(nested, 'commit', '-q', '-m', 'init')
+    web = superproject / 'src' / 'OCA' / 'web'
+    git(web, 'submodule', 'add', '-q', str(nested), 'nested')
+    git(web, 'commit', '-q', '-m', 'add nested')
+    git(superproject, 'commit', '-q', '-am', 'bump web')
+
+    # Added submodules count with all their files
+    assert changed_files(superproject, 'HEAD~1') == [
+        web / '.gitmodules', web / 'nested' / 'nested_addon' / '__manifest__.py']
+
+    # A change in the submodule of a submodule
+    (web / 'nested' / 'nested_addon' / 'new.py').write_text('')
+    git(web / 'nested', 'add', '-A')
+    git(web / 'nested', 'commit', '-q', '-m', 'change')
+    git(web, 'commit', '-q', '-am', 'bump nested')
+    git(superproject, 'commit', '-q', '-am', 'bump web')
+    assert changed_files(superproject, 'HEAD~1') == [web / 'nested' / 'nested_addon' / 'new.py']
+
+
+@pytest.fixture
+def core_repo(core_tree, git_env):
+    """ The core tree as git repository with one commit """
+    git(core_tree.core_dir, 'init', '-q')
+    git(core_tree.core_dir, 'add', '-A')
+    git(core_tree.core_dir, 'commit', '-q', '-m', 'init')
+    return core_tree
+
+
+def test_changed_addons_task(core_repo, invoke_context, capsys):
+    web_widget = core_repo.core_dir / 'src' / 'OCA' / 'web' / 'web_widget'
+    (web_widget / 'widget.py').write_text('')
+    git(core_repo.core_dir, 'add', '-A')
+    git(core_repo.core_dir, 'commit', '-q', '-m', 'change')
+
+    # web_widget and the addon that depends on it
+    assert changed_addons(invoke_context, 'HEAD~1') == ['web_widget', 'dadi_base']
+    assert capsys.readouterr().out == 'web_widget,dadi_base\n'
+    assert changed_addons(invoke_context, core_range='HEAD') == []
+
+
+def test_changed_addons_task_bad_range(core_repo, invoke_context):
+    with pytest.raises(Exit, match="'v0.1' does not resolve in"):
+        changed_addons(invoke_context, 'v0.1')
+    with pytest.raises(Exit, match='No revision range'):
+        changed_addons(invoke_context)
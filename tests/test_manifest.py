@@ -0,0 +1,48 @@
+import pytest
+from pathlib import Path
+from tools.manifest import addon_manifests, parse_manifest, ManifestStore
+
+
+def _make_addon(path: Path):
+    path.mkdir(parents=True)
+    (path / '__manifest__.py').write_text("{'name': '%s'}" % path.name)
+
+
+def test_manifest_store(tmp_path):
+    _make_addon(tmp_path / 'addon_a')
+    (tmp_path / 'addon_b').mkdir()
+    (tmp_path / 'addon_b' / '__manifest__.py').write_text(
+        "# comment\n{'version': '14.0.1.0.0', 'depends': ['addon_a'], 'data': ['views/b.xml'],"
+        " 'external_dependencies': {'python': ['requests']}}")
+    cache_file = tmp_path / 'manifests.json'
+
+    manifests = addon_manifests([tmp_path / 'addon_a', tmp_path / 'addon_b'], cache_file=cache_file)
+    assert list(manifests) == ['addon_a', 'addon_b']
+    assert manifests['addon_b'].depends == ('addon_a',)
+    assert manifests['addon_b'].external_dependencies == {'python': ['requests']}
+    assert manifests['addon_b'].installable
+
+    # Unchanged manifests are served from the cache
+    store = ManifestStore(cache_file)
+    assert store.get([tmp_path / 'addon_b']) == {'addon_b': manifests['addon_b']}
+    # Nothing was parsed, so there is nothing to save
+    cache_file.unlink()
+    store.save()
+    assert not cache_file.exists()
+
+
+@pytest.mark.parametrize('manifest, error', [
+    ("{'depends': 'base'}", "'depends' in the manifest of addon 'addon_a' is not a list of strings"),
+    ("{'external_dependencies': ['requests']}", "'external_dependencies' in the manifest of addon 'addon_a'"),
+    ("{'external_dependencies': None}", "'external_dependencies' in the manifest of addon 'addon_a'"),
+])
+def test_parse_manifest_types(manifest, error):
+    with pytest.raises(ValueError, match=error):
+        parse_manifest(manifest, name='addon_a')
+
+
+def test_manifest_store_skips_malformed(tmp_path):
+    _make_addon(tmp_path / 'addon_a')
+    (tmp_path / 'addon_b').mkdir()
+    (tmp_path / 'addon_b' / '__manifest__.py').write_text("{'depends': 'addon_a'}")
+    assert list(addon_manifests([tmp_path / 'addon_a', tmp_path / 'addon_b'])) == ['addon_a']
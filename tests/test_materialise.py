@@ -0,0 +1,70 @@
+import os
+import pytest
+from tools.materialise import Materialiser, tree_files
+from tools.tasks.docker import materialise
+
+
+def test_materialise_task(core_tree, invoke_context):
+    tgt_dir = core_tree.build_fson_tgt_dir
+    result = materialise(invoke_context, method='copy')
+    assert result.created == {'copy': 8} and result.skipped == 0
+    manifest = tgt_dir / 'odoo' / 'addons' / 'dadi_base' / '__manifest__.py'
+    assert manifest.is_file() and not manifest.is_symlink()
+    assert not any(p.is_symlink() for p in tgt_dir.rglob('*'))
+
+    # Unchanged, touched or changed sources
+    source = core_tree.core_dir / 'src' / 'DADI' / 'addons' / 'dadi_base' / '__manifest__.py'
+    assert materialise(invoke_context, method='copy').skipped == 8
+    os.utime(source, ns=(1, 1))
+    assert materialise(invoke_context, method='copy').skipped == 8
+    source.write_text("{'depends': ['web']}")
+    assert materialise(invoke_context, method='copy').created == {'copy': 1}
+    assert manifest.read_text() == "{'depends': ['web']}"
+
+    # A changed target is copied again
+    manifest.write_text('')
+    assert materialise(invoke_context, method='copy').created == {'copy': 1}
+
+    # Files that are not needed anymore are removed (dadi_base does not depend on web_widget anymore)
+    result = materialise(invoke_context, method='copy', prune=True)
+    assert result.removed == 2
+    assert sorted(os.listdir(tgt_dir / 'odoo' / 'addons')) == ['__init__.py', 'base', 'dadi_base', 'web']
+
+
+def test_materialise_methods(tmp_path):
+    (tmp_path / 'src' / 'sub').mkdir(parents=True)
+    (tmp_path / 'src' / 'sub' / 'file.py').write_text('x = 1')
+    (tmp_path / 'src' / 'top.py').write_text('y = 2')
+    files = tree_files({tmp_path / 'build' / 'src': tmp_path / 'src'})
+    assert sorted(str(t.relative_to(tmp_path)) for t in files) == ['build/src/sub/file.py', 'build/src/top.py']
+
+    materialiser = Materialiser(tmp_path / 'build', tmp_path / 'manifest.json', method='hardlink')
+    assert materialiser.materialise(files).created == {'hardlink': 2}
+    assert os.stat(tmp_path / 'build' / 'src' / 'top.py').st_ino == os.stat(tmp_path / 'src' / 'top.py').st_ino
+
+    # 'auto' falls back to the next method if reflinks are not supported by the file system
+    materialiser = Materialiser(tmp_path / 'auto', tmp_path / 'auto.json')
+    files = tree_files({tmp_path / 'auto' / 'src': tmp_path / 'src'})
+    created = materialiser.materialise(files).created
+    assert sum(created.values()) == 2 and (tmp_path / 'auto' / 'src' / 'top.py').read_text() == 'y = 2'
+
+    with pytest.raises(ValueError, match='outside'):
+        materialiser.materialise({tmp_path / 'elsewhere': tmp_path / 'src' / 'top.py'})
+    with pytest.raises(ValueError, match='Unknown method'):
+        Materialiser(tmp_path, tmp_path / 'm.json', method='rsync')
+
+
+def test_tree_files_skips_vcs_metadata(core_tree, invoke_context):
+    ocb = core_tree.core_dir / 'src' / 'OCA' / 'OCB'
+    (ocb / '.git' / 'objects').mkdir(parents=True)
+    (ocb / '.git' / 'objects' / 'pack.pack').write_text('')
+    (ocb / '.github').mkdir()
+    (ocb / '.github' / 'ci.yml').write_text('')
+    (ocb / '.gitignore').write_text('*.pyc\n')
+    # The .git file of a nested submodule checkout
+    (ocb / 'odoo' / '.git').write_text('gitdir: ../../.git/modules/odoo\n')
+
+    materialise(invoke_context, method='copy')
+    tgt_dir = core_tree.build_fson_tgt_dir
+    assert sorted(os.listdir(tgt_dir)) == ['odoo', 'odoo-bin']
+    assert not (tgt_dir / 'odoo' / '.git').exists()
@@ -0,0 +1,63 @@
+import sys
+import tarfile
+import pytest
+from tools.build_context import context_dockerfile
+from tools.precompile import compileall_command, precompile, precompile_instruction
+from tools.tasks.docker import build
+
+
+def test_compileall_command():
+    assert compileall_command(['/opt/odoo'], exclude=None) == [
+        'python3', '-m', 'compileall', '-q', '-j', '0', '/opt/odoo']
+    assert compileall_command(['a', 'b'], python='python3.8', workers=4, invalidation_mode='checked-hash') == [
+        'python3.8', '-m', 'compileall', '-q', '-j', '4', '--invalidation-mode', 'checked-hash', '-x', '/static/',
+        'a', 'b']
+    with pytest.raises(ValueError):
+        compileall_command(['a'], invalidation_mode='never')
+
+
+def test_precompile_instruction():
+    assert precompile_instruction(['/opt/odoo/odoo', '/opt/odoo/my addon'], invalidation_mode='unchecked-hash') == (
+        "RUN python3 -m compileall -q -j 0 --invalidation-mode unchecked-hash -x /static/ \\\n"
+        "    /opt/odoo/odoo \\\n"
+        "    '/opt/odoo/my addon'")
+
+
+def test_precompile(tmp_path):
+    (tmp_path / 'addon').mkdir()
+    (tmp_path / 'addon' / 'models.py').write_text('X = 1\n')
+    assert precompile([str(tmp_path)], python=sys.executable, invalidation_mode='unchecked-hash')
+    pyc = next((tmp_path / 'addon' / '__pycache__').glob('models.*.pyc'))
+    # The flags of a hash based pyc (PEP 552): bit 0 hash based, bit 1 check source
+    assert int.from_bytes(pyc.read_bytes()[4:8], 'little') == 0b01
+
+    # Files below static/ are not compiled by default, any other file that does not compile is an error
+    (tmp_path / 'addon' / 'static').mkdir()
+    (tmp_path / 'addon' / 'static' / 'build.py').write_text('print "python 2"\n')
+    assert precompile([str(tmp_path)], python=sys.executable)
+    (tmp_path / 'addon' / 'broken.py').write_text('print "python 2"\n')
+    assert not precompile([str(tmp_path)], python=sys.executable)
+
+
+def test_layered_build_precompiles_every_layer(core_tree, invoke_context, tmp_path):
+    # Repository metadata is neither copied nor compiled
+    (core_tree.core_dir / 'src' / 'OCA' / 'OCB' / '.github').mkdir()
+    dockerfile = tmp_path / 'Dockerfile'
+    dockerfile.write_text('FROM scratch\n')
+    context = tmp_path / 'context.tar'
+    build(invoke_context, dockerfile=str(dockerfile), output=str(context), prune=True)
+
+    with tarfile.open(context) as tar:
+        lines = tar.extractfile('Dockerfile').read().decode().splitlines()
+    copies = [i for i, line in enumerate(lines) if line.startswith('COPY ')]
+    assert copies and all(lines[i + 1].startswith('RUN python3 -m compileall') for i in copies)
+    assert '    /opt/odoo/odoo/addons/dadi_base \\' in lines
+    assert not any('.github' in line for line in lines)
+
+
+def test_volume_follows_precompile():
+    dockerfile = context_dockerfile('FROM python:3.8\nVOLUME ["/opt/odoo"]\nWORKDIR /opt/odoo\n',
+                                    after=precompile_instruction(['/opt/odoo']))
+    lines = [line for line in dockerfile.splitlines() if line]
+    assert lines[-1] == 'VOLUME ["/opt/odoo"]' and lines.count('VOLUME ["/opt/odoo"]') == 1
+    assert lines.index('WORKDIR /opt/odoo') < lines.index('COPY fsonline/ /opt/odoo/')
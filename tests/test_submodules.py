@@ -0,0 +1,68 @@
+import shutil
+from pathlib import Path
+import pytest
+from tools.submodules import read_gitmodules, update_mirrors, update_submodules, drifted_submodules
+from tools.sparse import submodule_addons, plan_sparse_checkout, apply_sparse_checkout
+from .conftest import git
+
+
+def test_read_gitmodules(superproject):
+    submodules = read_gitmodules(superproject)
+    assert [(s.path, s.branch) for s in submodules] == [('src/OCA/web', '14.0'), ('src/OCA/project', '14.0')]
+
+
+def test_update_submodules(superproject):
+    results = update_submodules(superproject, jobs=2)
+    assert [(r.submodule.path, r.ok, r.attempts) for r in results] == [
+        ('src/OCA/web', True, 1), ('src/OCA/project', True, 1)]
+    assert (superproject / 'src' / 'OCA' / 'web' / 'web_addon' / '__manifest__.py').is_file()
+    assert (superproject / 'src' / 'OCA' / 'project' / 'project_addon' / '__manifest__.py').is_file()
+
+
+def test_update_submodules_retry(superproject):
+    gitmodules = superproject / '.gitmodules'
+    gitmodules.write_text(gitmodules.read_text().replace('web.git', 'missing.git'))
+    results = update_submodules(superproject, retries=2)
+    assert [(r.submodule.path, r.ok, r.attempts) for r in results] == [
+        ('src/OCA/web', False, 3), ('src/OCA/project', True, 1)]
+
+
+def test_update_submodules_offline_from_mirrors(superproject, tmp_path):
+    mirror_dir = tmp_path / 'mirrors'
+    results = update_mirrors(mirror_dir, read_gitmodules(superproject))
+    assert all(r.ok for r in results)
+
+    # Remove the upstream repositories: the submodules can only be cloned from the mirrors
+    shutil.rmtree(tmp_path / 'upstream')
+    results = update_submodules(superproject, mirror_dir=mirror_dir, offline=True)
+    assert all(r.ok for r in results)
+    assert (superproject / 'src' / 'OCA' / 'web' / 'web_addon' / '__manifest__.py').is_file()
+
+
+def test_sparse_checkout(superproject):
+    update_submodules(superproject)
+    addons = submodule_addons(superproject, [Path('src/OCA/web/*'), Path('src/OCA/project/*')])
+    assert sorted(a.name for a in addons) == ['project_addon', 'web_addon', 'web_unused']
+
+    plan = plan_sparse_checkout(addons, ['project_addon'])
+    web, project = superproject / 'src' / 'OCA' / 'web', superproject / 'src' / 'OCA' / 'project'
+    assert plan == {web: ['web_addon'], project: ['project_addon']}
+
+    apply_sparse_checkout(plan)
+    assert (web / 'web_addon').is_dir()
+    assert not (web / 'web_unused').exists()
+
+
+def test_update_submodules_drift_only(superproject):
+    assert len(update_submodules(superproject, drift_only=True)) == 2
+    assert update_submodules(superproject, drift_only=True) == []
+
+    # Move the checked out HEAD of one submodule away from the recorded commit
+    web = superproject / 'src' / 'OCA' / 'web'
+    (web / 'web_addon' / 'new.py').write_text('')
+    git(web, 'add', '-A')
+    git(web, 'commit', '-q', '-m', 'drift')
+    submodules = read_gitmodules(superproject)
+    assert drifted_submodules(superproject, submodules) == [submodules[0]]
+    assert [r.submodule.path for r in update_submodules(superproject, drift_only=True)] == ['src/OCA/web']
+    assert drifted_submodules(superproject, submodules) == []
@@ -1,5 +1,50 @@
+import os
 from tools.tasks.dev import symlink_odoo
 
 
-def test_symlink_odoo():
-    symlink_odoo(clean=True)
+def test_symlink_odoo(core_tree, invoke_context):
+    plan = symlink_odoo(invoke_context, clean=True)
+    tgt_dir = core_tree.dev_fson_tgt_dir
+    addons_dir = tgt_dir / 'odoo' / 'addons'
+    assert sorted(os.listdir(addons_dir)) == ['__init__.py', 'base', 'dadi_base', 'mail', 'web', 'web_widget']
+    assert (addons_dir / 'dadi_base').resolve() == core_tree.core_dir / 'src' / 'DADI' / 'addons' / 'dadi_base'
+    assert os.readlink(tgt_dir / 'odoo-bin') == '../../src/OCA/OCB/odoo-bin'
+    assert sum(1 for op in plan if op.op == 'symlink') == 8
+
+    # No links to change if nothing changed
+    assert [op for op in symlink_odoo(invoke_context, update=True) if op.op != 'mkdir'] == []
+
+    # Only the needed addons are linked
+    symlink_odoo(invoke_context, update=True, prune=True)
+    assert sorted(os.listdir(addons_dir)) == ['__init__.py', 'base', 'dadi_base', 'web', 'web_widget']
+
+
+def test_symlink_odoo_keeps_foreign_links(core_tree, invoke_context):
+    # Links in dev_dir next to the odoo tree do not belong to symlink_odoo
+    core_tree.dev_dir.mkdir()
+    (core_tree.dev_dir / 'notes').symlink_to(core_tree.core_dir / 'core.env')
+    symlink_odoo(invoke_context, clean=True)
+    symlink_odoo(invoke_context, update=True)
+    assert (core_tree.dev_dir / 'notes').is_symlink()
+
+
+def test_symlink_odoo_prune(core_tree, invoke_context):
+    # A third party addon that no addon to install depends on
+    unused = core_tree.core_dir / 'src' / 'OCA' / 'web' / 'web_unused'
+    unused.mkdir()
+    (unused / '__manifest__.py').write_text("{'name': 'web_unused', 'depends': ['mail']}")
+
+    symlink_odoo(invoke_context, clean=True, prune=True)
+    addons_dir = core_tree.dev_fson_tgt_dir / 'odoo' / 'addons'
+    # dadi_base -> web_widget -> web -> base, without mail and web_unused
+    assert sorted(os.listdir(addons_dir)) == ['__init__.py', 'base', 'dadi_base', 'web', 'web_widget']
+    assert sorted(os.listdir(core_tree.dev_fson_tgt_dir)) == ['odoo', 'odoo-bin']
+
+
+def test_symlink_odoo_dry(core_tree, invoke_context, capsys):
+    plan = symlink_odoo(invoke_context, dry=True)
+    lines = capsys.readouterr().out.splitlines()
+    assert lines == [str(op) for op in plan]
+    assert f"mkdir {core_tree.dev_dir}" in lines
+    assert f"symlink {core_tree.dev_fson_tgt_dir / 'odoo-bin'} -> ../../src/OCA/OCB/odoo-bin" in lines
+    assert not core_tree.dev_dir.exists()
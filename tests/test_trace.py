@@ -0,0 +1,49 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from tools import trace
+from tools.helper import log_time
+
+
+def test_trace_disabled():
+    assert trace.tracer() is None
+    with trace.span('nothing', a=1) as args:
+        args['b'] = 2
+    trace.count('fs.symlink')
+    assert trace.inherit(len) is len
+
+
+def test_trace_spans_and_export(tmp_path):
+    tracer = trace.enable(tmp_path / 'trace.json')
+    try:
+        def job(i):
+            with trace.span('job', i=i):
+                return threading.get_ident()
+
+        @log_time
+        def task():
+            with trace.span('step', n=1) as args:
+                trace.count('subprocess', 2)
+                args['found'] = 3
+            # Spans of jobs in other threads are nested in the span that submitted them
+            with ThreadPoolExecutor(2) as executor:
+                list(executor.map(trace.inherit(job), range(4)))
+
+        task()
+        task()
+    finally:
+        assert trace.disable() is tracer
+
+    paths = {s.parents + (s.name,) for s in tracer.spans}
+    assert paths == {('task',), ('task', 'step'), ('task', 'job')}
+    assert tracer.counters['subprocess'] == 4
+
+    lines = tracer.summary().splitlines()
+    assert [line.split()[-2:] for line in lines[1:]] == [
+        ['2', 'task'], ['2', 'step'], ['8', 'job'], ['4', '#subprocess']]
+
+    tracer.save(tracer.trace_file)
+    events = json.loads(tracer.trace_file.read_text())['traceEvents']
+    assert sum(1 for e in events if e['ph'] == 'X') == 12
+    assert {e['args']['found'] for e in events if e['name'] == 'step'} == {'3'}
+    assert events[-1] == {**events[-1], 'ph': 'C', 'args': {'subprocess': 4}}
@@ -0,0 +1,131 @@
+import heapq
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from .manifest import AddonManifest
+
+
+class AddonCycleError(ValueError):
+    """ Raised if the addon dependencies contain a cycle """
+
+    def __init__(self, cycle: List[str]):
+        self.cycle = cycle
+        super().__init__(f"Dependency cycle: {' -> '.join(cycle)}")
+
+
+class AddonGraph:
+    """ Dependency graph of odoo addons
+
+    All operations are iterative (no recursion limit) and linear in the number of addons and dependencies.
+    Dependencies that are not part of the graph (e.g. addons that were not found) are treated as leaves and can be
+    listed with missing().
+    """
+
+    def __init__(self, depends: Dict[str, Iterable[str]]):
+        self.depends: Dict[str, Tuple[str, ...]] = {name: tuple(deps) for name, deps in depends.items()}
+        self._dependents: Optional[Dict[str, List[str]]] = None
+
+    @classmethod
+    def from_manifests(cls, manifests: Dict[str, AddonManifest]) -> 'AddonGraph':
+        return cls({name: m.depends for name, m in manifests.items()})
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.depends
+
+    def __len__(self) -> int:
+        return len(self.depends)
+
+    def dependents(self, name: str) -> List[str]:
+        """ Returns the addons that depend directly on the given addon """
+        if self._dependents is None:
+            dependents: Dict[str, List[str]] = {}
+            for addon, deps in self.depends.items():
+                for dep in dict.fromkeys(deps):
+                    dependents.setdefault(dep, []).append(addon)
+            self._dependents = dependents
+        return self._dependents.get(name, [])
+
+    def missing(self, names: Optional[Iterable[str]] = None) -> Set[str]:
+        """ Returns the dependencies of the given addons (default: all addons) that are not in the graph """
+        names = self.depends if names is None else names
+        return {dep for name in names for dep in self.depends.get(name, ()) if dep not in self.depends}
+
+    def closure(self, roots: Iterable[str]) -> Set[str]:
+        """ Returns the roots and all their direct and indirect dependencies """
+        closure: Set[str] = set()
+        stack = list(roots)
+        while stack:
+            name = stack.pop()
+            if name in closure:
+                continue
+            closure.add(name)
+            stack.extend(self.depends.get(name, ()))
+        return closure
+
+    def reverse_closure(self, names: Iterable[str]) -> Set[str]:
+        """ Returns the given addons and all addons that depend directly or indirectly on them """
+        closure: Set[str] = set()
+        stack = list(names)
+        while stack:
+            name = stack.pop()
+            if name in closure:
+                continue
+            closure.add(name)
+            stack.extend(self.dependents(name))
+        return closure
+
+    def find_cycle(self, names: Optional[Iterable[str]] = None) -> Optional[List[str]]:
+        """ Returns the first dependency cycle (e.g. ['a', 'b', 'a']) in the subgraph of names or None """
+        allowed = set(self.depends if names is None else set(names) & self.depends.keys())
+        nodes = sorted(allowed)
+        # 0: unvisited, 1: on the current path, 2: done
+        state: Dict[str, int] = {}
+        for start in nodes:
+            if state.get(start):
+                continue
+            path: List[str] = [start]
+            iterators = [iter(self.depends.get(start, ()))]
+            state[start] = 1
+            while iterators:
+                dep = next(iterators[-1], None)
+                if dep is None:
+                    state[path.pop()] = 2
+                    iterators.pop()
+                    continue
+                if dep not in allowed:
+                    continue
+                if state.get(dep) == 1:
+                    return path[path.index(dep):] + [dep]
+                if not state.get(dep):
+                    state[dep] = 1
+                    path.append(dep)
+                    iterators.append(iter(self.depends[dep]))
+        return None
+
+    def topological_order(self, names: Optional[Iterable[str]] = None) -> List[str]:
+        """ Returns the addons (default: all) in install order: every addon comes after its dependencies
+
+        Addons without an order between them are sorted by name, so the result is deterministic. Dependencies that
+        are not in names are ignored. Raises AddonCycleError if the addons can not be ordered.
+        """
+        nodes = set(self.depends if names is None else names)
+        pending: Dict[str, int] = {}
+        for name in nodes:
+            pending[name] = sum(1 for dep in set(self.depends.get(name, ())) if dep in nodes)
+        ready = [name for name, count in pending.items() if count == 0]
+        heapq.heapify(ready)
+        order: List[str] = []
+        while ready:
+            name = heapq.heappop(ready)
+            order.append(name)
+            for dependent in self.dependents(name):
+                if dependent in nodes and dependent in pending:
+                    pending[dependent] -= 1
+                    if pending[dependent] == 0:
+                        heapq.heappush(ready, dependent)
+                        del pending[dependent]
+        if len(order) != len(nodes):
+            raise AddonCycleError(self.find_cycle(nodes - set(order)) or sorted(nodes - set(order)))
+        return order
+
+    def install_order(self, roots: Iterable[str]) -> List[str]:
+        """ Returns the dependency closure of the roots in install order """
+        return self.topological_order(self.closure(roots))
@@ -0,0 +1,196 @@
+""" Benchmarks of the tooling on synthetic repositories
+
+generate_tree() creates a core repository with a fake odoo, env files and N submodule-like addon roots with M addons
+each. The manifests get a random (but reproducible and acyclic) dependency graph. run_benchmarks() times the hot
+paths of the tooling on such trees of several sizes. The results are stored as JSON so that runs can be compared
+with compare_results() to find regressions.
+"""
+import json
+import os
+import platform
+import random
+import statistics
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Callable, Dict, List, NamedTuple, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+BENCHMARK_VERSION = 1
+BENCHMARK_SIZES = (100, 1000, 5000, 20000)
+# Number of addon roots (submodules) of a generated tree
+BENCHMARK_ROOTS = 10
+# Number of addons processed by the CopierPostProcessing benchmark
+COPIER_SAMPLE = 50
+
+
+class BenchmarkResult(NamedTuple):
+    benchmark: str
+    addons: int
+    # Seconds of every run, the first run is the cold one (no caches)
+    runs: List[float]
+
+    def to_json(self) -> dict:
+        return {**self._asdict(), 'first': self.runs[0], 'median': statistics.median(self.runs),
+                'min': min(self.runs)}
+
+
+def _manifest(name: str, depends: List[str]) -> str:
+    return repr({'name': name, 'version': '14.0.1.0.0', 'depends': depends, 'data': [], 'installable': True})
+
+
+def generate_tree(root: Path, addons: int, roots: int = BENCHMARK_ROOTS, max_depends: int = 4, seed: int = 0,
+                  copier_sample: int = COPIER_SAMPLE) -> List[Path]:
+    """ Generate a core repository with 'addons' addons evenly spread over 'roots' addon roots in root
+
+    Every addon depends on 'base' and up to max_depends random addons that were generated before it. The first
+    copier_sample addons get models, views and a security file for the CopierPostProcessing benchmark.
+
+    :return: The addon directories
+    """
+    rng = random.Random(seed)
+    (root / '.git').mkdir(parents=True)
+
+    odoo_dir = root / 'src' / 'OCA' / 'OCB'
+    for name in ('base', 'web'):
+        addon_dir = odoo_dir / 'odoo' / 'addons' / name
+        addon_dir.mkdir(parents=True)
+        (addon_dir / '__manifest__.py').write_text(_manifest(name, [] if name == 'base' else ['base']))
+    (odoo_dir / 'addons').mkdir()
+    (odoo_dir / 'odoo-bin').write_text('')
+    (odoo_dir / 'odoo' / '__init__.py').write_text('')
+
+    per_root = max(1, addons // roots)
+    addon_src = [f"src/BENCH/repo_{r}/*" for r in range(roots)]
+    names: List[str] = []
+    addon_dirs: List[Path] = []
+    for i in range(addons):
+        name = f"addon_{i}"
+        addon_dir = root / 'src' / 'BENCH' / f"repo_{min(i // per_root, roots - 1)}" / name
+        addon_dir.mkdir(parents=True)
+        depends = ['base'] + rng.sample(names, min(len(names), rng.randint(0, max_depends)))
+        manifest = _manifest(name, depends)
+        (addon_dir / '__manifest__.py').write_text(manifest)
+        (addon_dir / '__init__.py').write_text('')
+        if i < copier_sample:
+            # The copier templates name the manifest 'manifest.py'
+            (addon_dir / 'manifest.py').write_text(manifest)
+            for sub_dir, file_name in (('models', f"{name}_model.py"), ('views', f"{name}_views.xml"),
+                                       ('security', 'ir.model.access.csv')):
+                (addon_dir / sub_dir).mkdir()
+                (addon_dir / sub_dir / file_name).write_text('')
+        names.append(name)
+        addon_dirs.append(addon_dir)
+
+    (root / 'core.env').write_text(
+        f"CORE_ODOO_SRC=\"src/OCA/OCB\"\n"
+        f"CORE_ADDON_SRC='{json.dumps(addon_src)}'\n"
+        f"CORE_ADDONS_TO_INSTALL='{json.dumps(names[-3:])}'\n"
+        f"INST_ADDON_SRC='[]'\n")
+    (root / 'core.env.dev').write_text("CORE_ADDONS_TO_INSTALL='[\"addon_0\"]'\n")
+    (root / 'core.env.local').write_text("# local overrides\n")
+    return addon_dirs
+
+
+def _time(func: Callable, repeat: int) -> List[float]:
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        runs.append(time.perf_counter() - start)
+    return runs
+
+
+def benchmark_tree(root: Path, addon_dirs: List[Path], repeat: int = 3) -> List[BenchmarkResult]:
+    """ Run all benchmarks on a generated tree (see generate_tree()) """
+    # Imported here because the settings (pydantic), invoke and the copier post processing are only needed here
+    from invoke import Config, Context
+    from tools.env_settings import use_conventions, fsonline_env
+    from tools.helper import find_addons, merge_env_files
+    from tools.tasks.dev import symlink_odoo
+    from tools.template_post_processing import CopierPostProcessing
+
+    n = len(addon_dirs)
+    results: List[BenchmarkResult] = []
+
+    def add(name: str, func: Callable):
+        results.append(BenchmarkResult(name, n, _time(func, repeat)))
+        logger.info(f"{name} ({n} addons): {statistics.median(results[-1].runs):.3f}s")
+
+    with use_conventions(root) as cov:
+        settings = fsonline_env(env='DEV')
+        # The search paths of the tree (CORE_ADDON_SRC of generate_tree())
+        search_paths = settings.core_addon_src
+        found = len(find_addons(search_paths, start_dir=root))
+        if found != n:
+            raise ValueError(f"The search paths {search_paths} find {found} of the {n} addons of '{root}'")
+        env_files = [cov.core_env_file, cov.inst_env_file]
+        index_file = root / '.cache' / 'benchmark_addon_index.json'
+
+        add('find_addons', lambda: find_addons(search_paths, start_dir=root))
+        add('find_addons_indexed', lambda: find_addons(search_paths, start_dir=root, index_file=index_file))
+        add('merge_env_files', lambda: merge_env_files('DEV', env_files))
+        add('fsonline_env', lambda: fsonline_env(env='DEV'))
+
+        context = Context(Config(overrides={'fsonline_env_settings': settings}))
+        add('symlink_odoo', lambda: symlink_odoo(context, clean=True))
+        add('symlink_odoo_update', lambda: symlink_odoo(context, update=True))
+
+        # The addons that generate_tree() prepared for the copier post processing (copier_sample)
+        sample = [d for d in addon_dirs if (d / 'manifest.py').is_file()]
+        post_logger = logging.getLogger(CopierPostProcessing.__module__)
+        level = post_logger.level
+        post_logger.setLevel(logging.WARNING)
+        try:
+            add('copier_post_processing', lambda: [CopierPostProcessing(d).process() for d in sample])
+        finally:
+            post_logger.setLevel(level)
+    return results
+
+
+def run_benchmarks(sizes: List[int] = BENCHMARK_SIZES, repeat: int = 3, work_dir: Optional[Path] = None,
+                   seed: int = 0) -> dict:
+    """ Generate a tree per size in a temporary directory and benchmark it
+
+    :param work_dir: Where to create the temporary trees. The file system matters: use the one of the real repo.
+    :return: The results and the machine they were measured on (see save_results())
+    """
+    results: List[BenchmarkResult] = []
+    for size in sizes:
+        with TemporaryDirectory(prefix=f"fsonline-bench-{size}-", dir=work_dir) as tmp:
+            start = time.perf_counter()
+            addon_dirs = generate_tree(Path(tmp) / 'core', size, seed=seed)
+            logger.info(f"Generated {size} addons in {time.perf_counter() - start:.2f}s")
+            results += benchmark_tree(Path(tmp) / 'core', addon_dirs, repeat=repeat)
+    return {
+        'version': BENCHMARK_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'machine': {'python': platform.python_version(), 'platform': platform.platform(),
+                    'cpus': os.cpu_count()},
+        'results': [r.to_json() for r in results],
+    }
+
+
+def save_results(results: dict, path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(results, indent=1))
+
+
+def compare_results(old: dict, new: dict, threshold: float = 0.1) -> List[str]:
+    """ Returns a line per benchmark and size in both results with the change of the median time
+
+    Changes above the threshold (0.1 = 10% slower) are marked as REGRESSION.
+    """
+    old_medians: Dict[tuple, float] = {(r['benchmark'], r['addons']): r['median'] for r in old['results']}
+    lines = []
+    for r in new['results']:
+        before = old_medians.get((r['benchmark'], r['addons']))
+        if before is None:
+            continue
+        change = (r['median'] - before) / before if before else 0.0
+        mark = '  REGRESSION' if change > threshold else ''
+        lines.append(f"{r['benchmark']:24} {r['addons']:6d}  {before:8.3f}s -> {r['median']:8.3f}s  "
+                     f"{change:+7.1%}{mark}")
+    return lines
@@ -0,0 +1,79 @@
+""" Stream a minimal docker build context: the Dockerfile, odoo and the resolved addons only
+
+Sending the repository as build context uploads all submodules with their .git data. Instead the context is
+written as tar stream (e.g. to the stdin of 'docker build -') that holds only the files of the odoo tree (see
+dev.fson_links()). Symlinks are resolved: the stream contains regular files only.
+"""
+import io
+import os
+import re
+import tarfile
+from pathlib import Path
+from typing import BinaryIO, Dict, List
+from . import trace
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Directory of the odoo tree in the build context
+CONTEXT_SRC_DIR = 'fsonline'
+# The odoo tree in the image (see the ENTRYPOINT of tools/docker/Dockerfile)
+IMAGE_SRC_DIR = '/opt/odoo'
+CONTEXT_BUFSIZE = 1 << 20
+VOLUME_RE = re.compile(r'^\s*VOLUME\s.*$', re.MULTILINE | re.IGNORECASE)
+
+
+def append_to_dockerfile(base: str, instructions: str) -> str:
+    """ Returns the base Dockerfile with the instructions appended
+
+    The VOLUME declarations of the base move behind the instructions: the classic builder discards everything a RUN
+    writes below a volume that is declared before it (e.g. the pyc files of a precompile step).
+    """
+    volumes: List[str] = [m.group(0).strip() for m in VOLUME_RE.finditer(base)]
+    base = VOLUME_RE.sub('', base) if volumes else base
+    tail = ''.join(f"{volume}\n" for volume in volumes)
+    return f"{base.rstrip()}\n\n\n{instructions.rstrip()}\n" + (f"\n{tail}" if tail else '')
+
+
+def context_dockerfile(base: str, after: str = '') -> str:
+    """ Returns the base Dockerfile with a COPY of the odoo tree of the context into the image
+
+    :param after: Instruction that follows the COPY (e.g. to precompile the odoo tree)
+    """
+    after = f"\n{after}" if after else ''
+    return append_to_dockerfile(base, f"# odoo and addons\nCOPY {CONTEXT_SRC_DIR}/ {IMAGE_SRC_DIR}/{after}")
+
+
+def _tarinfo(name: str, st: os.stat_result) -> tarfile.TarInfo:
+    info = tarfile.TarInfo(name)
+    info.size = st.st_size
+    info.mtime = int(st.st_mtime)
+    # Owner and permissions do not depend on the host
+    info.mode = 0o755 if st.st_mode & 0o111 else 0o644
+    info.uid = info.gid = 0
+    info.uname = info.gname = 'root'
+    return info
+
+
+@trace.traced
+def write_context(fileobj: BinaryIO, dockerfile: str, files: Dict[Path, Path], bufsize: int = CONTEXT_BUFSIZE) -> int:
+    """ Write the build context as (uncompressed) tar stream to fileobj
+
+    :param dockerfile: Content of the Dockerfile
+    :param files: {path in the context: source file} (see materialise.tree_files()). Symlinks are followed.
+    :return: The number of bytes of file content written
+    """
+    written = 0
+    with tarfile.open(fileobj=fileobj, mode='w|', bufsize=bufsize, format=tarfile.PAX_FORMAT) as tar:
+        data = dockerfile.encode()
+        info = tarfile.TarInfo('Dockerfile')
+        info.size = len(data)
+        info.mode = 0o644
+        tar.addfile(info, io.BytesIO(data))
+        for name, source in sorted(files.items()):
+            with open(source, 'rb') as f:
+                info = _tarinfo(name.as_posix(), os.fstat(f.fileno()))
+                tar.addfile(info, f)
+            written += info.size
+    trace.count('build_context.files', len(files))
+    return written
@@ -0,0 +1,197 @@
+""" Content hashes of files and directory trees (Merkle) as build cache keys
+
+A file hash is the blake2b digest of its content. It is memoised by the stat of the file, so unchanged files are
+not read again. A tree hash combines the names, kinds and hashes of all entries of a directory recursively, so it
+only depends on the content and the relative paths: not on the location, mtimes or owners of the files.
+"""
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from .helper import atomic_write, DISCOVERY_WORKERS
+from .submodules import git_dir, head_commit
+from . import trace
+import logging
+
+logger = logging.getLogger(__name__)
+
+HASH_CACHE_VERSION = 1
+LOCK_FILE_VERSION = 1
+HASH_CHUNK_SIZE = 1 << 20
+# Version control and CI metadata (files or directories) that does not belong to the content of a tree. The '.git'
+# file of a submodule checkout holds the location of the repository on the disk.
+VCS_METADATA = frozenset({'.git', '.github', '.gitlab', '.gitignore', '.gitmodules', '.gitattributes', '.gitlab-ci.yml',
+                          '.hg', '.hgignore', '.svn', '.bzr'})
+# Generated files that do not belong to the content of a tree
+IGNORED_DIRS = {'__pycache__'} | VCS_METADATA
+IGNORED_SUFFIXES = ('.pyc', '.pyo')
+# Name of the odoo tree (without its addons) in the lock file
+ODOO_TREE = 'odoo'
+
+
+def file_digest(path: Path) -> str:
+    """ Returns the blake2b digest of the content of a file """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _stat_key(st: os.stat_result) -> List[int]:
+    return [st.st_mtime_ns, st.st_size, st.st_ino]
+
+
+def list_tree(root: Path, exclude: Iterable[str] = ()) -> List[Tuple[str, str, bool]]:
+    """ Returns all files below root as (relative posix path, absolute path, executable), symlinks are followed
+
+    :param exclude: Relative posix paths of files or directories to skip
+    """
+    exclude = set(exclude)
+    files = []
+    for dirpath, dirnames, filenames in os.walk(root, followlinks=True):
+        rel_dir = os.path.relpath(dirpath, root).replace(os.sep, '/')
+        prefix = '' if rel_dir == '.' else f"{rel_dir}/"
+        dirnames[:] = sorted(d for d in dirnames if d not in IGNORED_DIRS and prefix + d not in exclude)
+        for name in sorted(filenames):
+            if name.endswith(IGNORED_SUFFIXES) or name in VCS_METADATA or prefix + name in exclude:
+                continue
+            path = os.path.join(dirpath, name)
+            files.append((prefix + name, path, os.access(path, os.X_OK)))
+    return files
+
+
+def merkle_hash(files: Iterable[Tuple[str, str]]) -> str:
+    """ Returns the Merkle hash of a tree given as (relative posix path, hash) of its files (with exec flag) """
+    # Nested dicts: directory name -> dict, file name -> 'f:<hash>' or 'x:<hash>'
+    tree: Dict[str, object] = {}
+    for rel_path, file_hash in files:
+        *dirs, name = rel_path.split('/')
+        node = tree
+        for d in dirs:
+            node = node.setdefault(d, {})
+        node[name] = file_hash
+
+    def node_hash(node: Dict[str, object]) -> str:
+        digest = hashlib.blake2b(digest_size=20)
+        for name in sorted(node):
+            child = node[name]
+            value = f"d:{node_hash(child)}" if isinstance(child, dict) else child
+            digest.update(f"{name}\0{value}\n".encode())
+        return digest.hexdigest()
+
+    return node_hash(tree)
+
+
+class HashStore:
+    """ File hashes memoised by the stat (mtime, size, inode) of the files, optionally cached in a json file
+
+    Safe to use from several threads.
+    """
+
+    def __init__(self, cache_file: Optional[Path] = None):
+        self.cache_file = cache_file
+        self._entries: Dict[str, list] = self._load()
+        self._changed = False
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, list]:
+        if not self.cache_file:
+            return {}
+        try:
+            cache = json.loads(self.cache_file.read_text())
+        except (FileNotFoundError, ValueError):
+            return {}
+        return cache.get('entries', {}) if cache.get('version') == HASH_CACHE_VERSION else {}
+
+    def save(self):
+        """ Write the cache file if any file was hashed since the last save. Entries of deleted files are dropped. """
+        if not self.cache_file or not self._changed:
+            return
+        with self._lock:
+            entries = {path: entry for path, entry in self._entries.items() if os.path.exists(path)}
+            self._changed = False
+        atomic_write(self.cache_file, json.dumps({'version': HASH_CACHE_VERSION, 'entries': entries}).encode())
+
+    def file_hash(self, path: Path) -> str:
+        """ Returns the content hash of a file, read only if its stat changed since it was hashed last """
+        key = str(path)
+        stat = _stat_key(os.stat(path))
+        entry = self._entries.get(key)
+        if entry and entry[0] == stat:
+            return entry[1]
+        trace.count('hash.files')
+        file_hash = file_digest(path)
+        with self._lock:
+            self._entries[key] = [stat, file_hash]
+            self._changed = True
+        return file_hash
+
+    @trace.traced
+    def tree_hashes(self, trees: Dict[str, Path], exclude: Optional[Dict[str, Set[str]]] = None,
+                    workers: Optional[int] = None) -> Dict[str, str]:
+        """ Returns the Merkle hash of every tree as {name: hash}. All files are hashed in one thread pool.
+
+        :param trees: {name: directory}
+        :param exclude: {name: relative paths to skip in the tree of name} (see list_tree())
+        """
+        exclude = exclude or {}
+        with ThreadPoolExecutor(max_workers=workers or DISCOVERY_WORKERS) as executor:
+            listed = dict(zip(trees, executor.map(
+                trace.inherit(lambda name: list_tree(trees[name], exclude.get(name, ()))), trees)))
+            paths = [path for files in listed.values() for _, path, _ in files]
+            hashes = dict(zip(paths, executor.map(trace.inherit(self.file_hash), paths, chunksize=64)))
+        return {name: merkle_hash((rel, f"{'x' if executable else 'f'}:{hashes[path]}")
+                                  for rel, path, executable in files)
+                for name, files in listed.items()}
+
+
+def repo_commit(path: Path, cache: Optional[Dict[Path, Optional[str]]] = None) -> Optional[str]:
+    """ Returns the HEAD commit of the (sub)module repository that contains path
+
+    :param cache: {directory: commit} shared by several calls to look up every repository only once
+    """
+    cache = {} if cache is None else cache
+    visited = []
+    commit = None
+    for directory in [path, *path.parents]:
+        if directory in cache:
+            commit = cache[directory]
+            break
+        visited.append(directory)
+        gitdir = git_dir(directory)
+        if gitdir:
+            commit = head_commit(gitdir)
+            break
+    for directory in visited:
+        cache[directory] = commit
+    return commit
+
+
+def lock_entries(trees: Dict[str, Path], hashes: Dict[str, str]) -> Dict[str, dict]:
+    """ Returns {name: {'path', 'hash', 'commit'}} with the commit of the repository (submodule) of every tree """
+    commits: Dict[Path, Optional[str]] = {}
+    return {name: {'path': str(path), 'hash': hashes[name], 'commit': repo_commit(path, commits)}
+            for name, path in trees.items()}
+
+
+def read_lock_file(lock_file: Path) -> Dict[str, dict]:
+    try:
+        lock = json.loads(lock_file.read_text())
+    except (FileNotFoundError, ValueError):
+        return {}
+    return lock.get('trees', {}) if lock.get('version') == LOCK_FILE_VERSION else {}
+
+
+def write_lock_file(lock_file: Path, entries: Dict[str, dict]):
+    atomic_write(lock_file, json.dumps({'version': LOCK_FILE_VERSION, 'trees': entries}, indent=1,
+                                       sort_keys=True).encode())
+
+
+def changed_trees(old: Dict[str, dict], new: Dict[str, dict]) -> Set[str]:
+    """ Returns the names of the trees that are new, gone or have another hash """
+    return {name for name in old.keys() | new.keys()
+            if (old.get(name) or {}).get('hash') != (new.get(name) or {}).get('hash')}
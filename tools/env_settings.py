@@ -4,81 +4,220 @@
 #            do this in the __init__ function (dont forget to call super). This will work as long as you do not
 #            plan to freeze the data by "allow_mutation = False". If you need locked Data you should compute the
 #            input data first and than just use a pydantic class object to validate and store the computed data.
+import contextvars
+import hashlib
+import os
+import pickle
 import pprint
-from functools import lru_cache
-from typing import Optional, Set, Literal, List
+from concurrent.futures import ThreadPoolExecutor
+import logging
+from contextlib import contextmanager
+from functools import lru_cache, cached_property
+from typing import Any, Optional, Set, Literal, List, Dict, Iterable, get_args
 from pathlib import Path
-import tempfile
 from pydantic import (
     BaseSettings,
     Field,
-    BaseModel,
     DirectoryPath,
-    FilePath,
     validator,
 )
 from .globals import ALLOWED_ENVIRONMENTS
+from . import helper, trace
 from .helper import (
+    addon_search_roots,
+    atomic_write,
+    env_file_candidates,
     find_addons,
     merge_env_files,
 )
+from .manifest import AddonManifest, addon_manifests
+from .addon_graph import AddonGraph
 
+logger = logging.getLogger(__name__)
 
-class Conventions(BaseModel):
-    """ All static conventions like file_names, folder_names, relative_locations should be represented here. """
-    script_file: FilePath = Path(__file__)
-    script_folder: DirectoryPath = Path(__file__).parent
+
+class Conventions:
+    """ All static conventions like file_names, folder_names, relative_locations should be represented here.
+
+    Locations are computed and validated on first access only, so importing the settings costs no file system
+    access and a task only validates the locations it actually uses. Use conventions() to get the (cached)
+    instance and use_conventions() to point them to another core repository (e.g. a test tree).
+    """
+    script_file: Path = Path(__file__)
+    script_folder: Path = Path(__file__).parent
 
     odoo_manifest_name: str = "__manifest__.py"
+    # Addons loaded by every odoo server, whether installed or not
+    odoo_server_wide_addons: List[str] = ['base', 'web']
 
     dev_dir_name: Path = Path('dev')
     stg_dir_name: Path = Path('stg')
     prd_dir_name: Path = Path('prd')
+    build_dir_name: Path = Path('build')
 
-    # core
     core_env_name: str = "core.env"
-    core_env_file: FilePath = script_folder.parent / core_env_name
-    core_dir: DirectoryPath = core_env_file.parent
-
-    # instance
     inst_env_name: str = "inst.env"
-    inst_env_file: Optional[FilePath] = (core_dir.parent / inst_env_name) if (
-            core_dir.parent / inst_env_name).is_file() else None
-    inst_dir: Optional[DirectoryPath] = inst_env_file.parent if inst_env_file else None
 
-    # basics
-    repo_dir: DirectoryPath = inst_dir or core_dir
+    def __init__(self, core_dir: Optional[Path] = None):
+        self._core_dir = Path(core_dir) if core_dir else self.script_folder.parent
+
+    def __repr__(self):
+        return f"Conventions(core_dir={str(self._core_dir)!r})"
 
-    dev_dir: Path = repo_dir / dev_dir_name
-    stg_dir: Path = repo_dir / stg_dir_name
-    prd_dir: Path = repo_dir / prd_dir_name
+    def __eq__(self, other):
+        return isinstance(other, Conventions) and self._core_dir == other._core_dir
 
-    dev_fson_tgt_dir = dev_dir / 'fsonline'
+    def __hash__(self):
+        return hash(self._core_dir)
 
-    @validator('core_dir', 'inst_dir', always=True)
-    def v_core_dir_inst_dir(cls, v):
-        if v and not (v / '.git').is_dir():
+    @staticmethod
+    def _git_repo_dir(v: Path) -> Path:
+        if not (v / '.git').is_dir():
             raise ValueError(f"'{v}' has no .git folder inside!")
         return v
 
-    @validator('repo_dir', always=True)
-    def v_repo_dir(cls, v, values):
+    # core
+    @cached_property
+    def core_env_file(self) -> Path:
+        v = self._core_dir / self.core_env_name
+        if not v.is_file():
+            raise ValueError(f"core_env_file '{v}' is missing")
+        return v
+
+    @cached_property
+    def core_dir(self) -> Path:
+        return self._git_repo_dir(self.core_env_file.parent)
+
+    # instance
+    @cached_property
+    def inst_env_file(self) -> Optional[Path]:
+        v = self._core_dir.parent / self.inst_env_name
+        return v if v.is_file() else None
+
+    @cached_property
+    def inst_dir(self) -> Optional[Path]:
+        return self._git_repo_dir(self.inst_env_file.parent) if self.inst_env_file else None
+
+    # basics
+    @cached_property
+    def repo_dir(self) -> Path:
+        v = self.inst_dir or self.core_dir
         if not v.is_absolute():
             raise ValueError(f"'{v}' must be absolute!")
         if v == Path("/"):
             raise ValueError(f"'{v}' can not be root '/'!")
         return v
 
-    class Config:
-        validate_assignment = True
+    @property
+    def dev_dir(self) -> Path:
+        return self.repo_dir / self.dev_dir_name
+
+    @property
+    def stg_dir(self) -> Path:
+        return self.repo_dir / self.stg_dir_name
+
+    @property
+    def prd_dir(self) -> Path:
+        return self.repo_dir / self.prd_dir_name
+
+    @property
+    def dev_fson_tgt_dir(self) -> Path:
+        return self.dev_dir / 'fsonline'
+
+    @property
+    def build_dir(self) -> Path:
+        return self.repo_dir / self.build_dir_name
+
+    @property
+    def build_fson_tgt_dir(self) -> Path:
+        return self.build_dir / 'fsonline'
+
+    # caches
+    @property
+    def cache_dir(self) -> Path:
+        return self.repo_dir / '.cache'
+
+    @property
+    def addon_index_file(self) -> Path:
+        return self.cache_dir / 'addon_index.json'
+
+    @property
+    def manifest_cache_file(self) -> Path:
+        return self.cache_dir / 'manifests.json'
+
+    @property
+    def env_cache_file(self) -> Path:
+        return self.cache_dir / 'fsonline_env.pickle'
+
+    @property
+    def materialise_manifest_file(self) -> Path:
+        return self.cache_dir / 'materialise.json'
+
+    @property
+    def content_hash_cache_file(self) -> Path:
+        return self.cache_dir / 'content_hashes.json'
+
+    # content hashes and commits of odoo and the addons of the last lock (see 'invoke docker.lock')
+    @property
+    def lock_file(self) -> Path:
+        return self.cache_dir / 'fsonline.lock.json'
+
+    # shared by all core and instance repositories of the host
+    @property
+    def git_mirror_dir(self) -> Path:
+        return Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')) / 'fsonline' / 'git-mirrors'
+
+
+# The core repository of the conventions returned by conventions(): None is the repository of this file. A context
+# variable keeps use_conventions() local to the thread (or copied context) that entered it.
+_conventions_core_dir: contextvars.ContextVar = contextvars.ContextVar('conventions_core_dir', default=None)
 
 
 @lru_cache()
+def _conventions(core_dir: Optional[Path]) -> Conventions:
+    return Conventions(core_dir)
+
+
 def conventions() -> Conventions:
-    return Conventions()
+    """ Returns the conventions of the current core repository (see use_conventions()), cached per repository """
+    return _conventions(_conventions_core_dir.get())
+
+
+@contextmanager
+def use_conventions(core_dir: Path):
+    """ Point conventions() (and with it all settings) to another core repository within the with block
+
+    Only the current thread is affected. Threads started within the block must run in a copy of its context (see
+    fsonline_envs()).
+    """
+    token = _conventions_core_dir.set(Path(core_dir).absolute())
+    try:
+        yield conventions()
+    finally:
+        _conventions_core_dir.reset(token)
+
 
+ENV_FILE_VALUES = '__env_file_values__'
 
-BASE_ENV_FILES = tempfile.NamedTemporaryFile(mode='w+')
+
+def customise_sources(init_settings, env_settings, file_secret_settings):
+    """ Settings sources by priority: kwargs > os environment > env files (see merge_env_files()) > secrets
+
+    The merged env file values are passed in with the kwargs under the key ENV_FILE_VALUES. This keeps the
+    settings classes free of shared state: every instance is built from its own values.
+    """
+    env_file_values = {k.lower(): v for k, v in init_settings.init_kwargs.pop(ENV_FILE_VALUES, {}).items()}
+
+    def env_file_settings(settings: BaseSettings) -> Dict[str, Any]:
+        values = {}
+        for field in settings.__fields__.values():
+            for env_name in field.field_info.extra.get('env_names', ()):
+                if env_name in env_file_values:
+                    values[field.alias] = env_file_values[env_name]
+                    break
+        return values
+
+    return init_settings, env_settings, env_file_settings, file_secret_settings
 
 
 class BaseEnv(BaseSettings):
@@ -88,47 +227,36 @@ class BaseEnv(BaseSettings):
     # TODO: Maybe we should remove the default to make sure the environment was consciously set?
     env: ALLOWED_ENVIRONMENTS = Field(default='DEV', env="FSONLINE_ENVIRONMENT")
 
-    # Merge the env files and update the tmp file before initializing the object
+    # Merge the env files before initializing the object
     def __init__(self, **data) -> None:
-        try:
-            # Get the environment either from the kwargs or use the same value as in class attrib 'env'
-            env_file_data = merge_env_files(target_env=None,
-                                            env_files=[conventions().core_env_file, conventions().inst_env_file]
-                                            ).getvalue()
-            BASE_ENV_FILES.write(env_file_data)
-            BASE_ENV_FILES.seek(0)
-            super(BaseEnv, self).__init__(**data)
-        except Exception as e:
-            raise e
-        finally:
-            BASE_ENV_FILES.seek(0)
-            BASE_ENV_FILES.truncate()
+        data[ENV_FILE_VALUES] = merge_env_files(target_env=None,
+                                                env_files=[conventions().core_env_file, conventions().inst_env_file])
+        super(BaseEnv, self).__init__(**data)
 
     class Config:
-        env_file = BASE_ENV_FILES.name
         validate_assignment = True
+        customise_sources = staticmethod(customise_sources)
 
 
 def base_env(**kwargs) -> BaseEnv:
     return BaseEnv(**kwargs)
 
 
-ENV_FILES = tempfile.NamedTemporaryFile(mode='w+')
-
-
 class CoreEnv(BaseSettings):
     """ core settings """
     # special settings
     env: ALLOWED_ENVIRONMENTS
-    env_file_data: Optional[str] = Field(env=None)
-    cov: Conventions = Field(default=conventions(), env=None)
+    env_file_values: Optional[Dict[str, Any]] = Field(env=None)
+    cov: Conventions = Field(default_factory=conventions, env=None)
 
     # merged conventions settings for the core
-    core_dir: DirectoryPath = Field(default=conventions().core_dir, env=None)
+    core_dir: DirectoryPath = Field(default_factory=lambda: conventions().core_dir, env=None)
 
     # ENVIRONMENT SETTINGS
     core_odoo_src: Path
     core_addon_src: List[Path] = list()
+    core_addons_to_install: List[str] = list()
+    git_mirror_dir: Path = Field(default_factory=lambda: conventions().git_mirror_dir)
 
     # COMPUTED SETTINGS
     core_odoo_dir: Optional[DirectoryPath] = None
@@ -149,43 +277,34 @@ class CoreEnv(BaseSettings):
         """ Compute and validate 'core_addon_dirs' """
         core_addon_src = values['core_addon_src']
         if core_addon_src:
-            v = find_addons(core_addon_src, start_dir=values['core_dir'], manifest=values['cov'].odoo_manifest_name)
+            v = find_addons(core_addon_src, start_dir=values['core_dir'], manifest=values['cov'].odoo_manifest_name,
+                            index_file=values['cov'].addon_index_file)
         return v
 
     def __init__(self, **data):
-        # merged core and instance environment files *.env > *.env.[dev] > *.env.local
-        try:
-            # Get the environment either from the kwargs or from base_env()
-            data['env'] = base_env(env=data['env']).env if data.get('env', None) else base_env().env
-            env_file_data = merge_env_files(target_env=data['env'],
-                                            env_files=[conventions().core_env_file, conventions().inst_env_file]
-                                            ).getvalue()
-            ENV_FILES.write(env_file_data)
-            ENV_FILES.seek(0)
-
-            super(CoreEnv, self).__init__(**data)
-            self.env_file_data = env_file_data
-        except Exception as e:
-            raise e
-        finally:
-            ENV_FILES.seek(0)
-            ENV_FILES.truncate()
+        # merged core and instance environment files *.env > *.env.local > *.env.[dev] > *.env.[dev].local
+        # Get the environment either from the kwargs or from base_env()
+        data['env'] = base_env(env=data['env']).env if data.get('env', None) else base_env().env
+        env_file_values = merge_env_files(target_env=data['env'],
+                                          env_files=[conventions().core_env_file, conventions().inst_env_file])
+        super(CoreEnv, self).__init__(**data, **{ENV_FILE_VALUES: env_file_values})
+        self.env_file_values = env_file_values
 
     class Config:
         validate_assignment = True
-        # ATTENTION: The configs seems to be merged for all inherited classes and the first class in the tree will
-        #            set the env_file (contrary to what i would have guessed - the last class wins ...)
-        env_file = ENV_FILES.name
+        arbitrary_types_allowed = True
+        customise_sources = staticmethod(customise_sources)
 
 
 class InstanceEnv(CoreEnv):
     """ Additional instance settings and overrides """
 
     # base settings
-    inst_dir: Optional[DirectoryPath] = Field(default=conventions().inst_dir, env=None)
+    inst_dir: Optional[DirectoryPath] = Field(default_factory=lambda: conventions().inst_dir, env=None)
 
     # ENVIRONMENT SETTINGS
     inst_addon_src: Optional[List[Path]]
+    inst_addons_to_install: List[str] = list()
 
     # COMPUTED SETTINGS
     inst_addon_dirs: Optional[List[DirectoryPath]] = Field(env=None)
@@ -195,26 +314,157 @@ class InstanceEnv(CoreEnv):
         """ Compute and validate 'inst_addon_dirs' """
         inst_addon_src = values['inst_addon_src']
         if inst_addon_src:
-            v = find_addons(inst_addon_src, start_dir=values['inst_dir'], manifest=values['cov'].odoo_manifest_name)
+            v = find_addons(inst_addon_src, start_dir=values['inst_dir'], manifest=values['cov'].odoo_manifest_name,
+                            index_file=values['cov'].addon_index_file)
         return v
 
 
 class FsonlineEnv(InstanceEnv):
 
     # merged conventions settings
-    repo_dir: DirectoryPath = Field(default=conventions().repo_dir, env=None)
-
-    dev_dir: Path = Field(default=conventions().dev_dir, env=None)
-    stg_dir: Path = Field(default=conventions().stg_dir, env=None)
-    prd_dir: Path = Field(default=conventions().prd_dir, env=None)
-
-    dev_fson_tgt_dir: Path = Field(default=conventions().dev_fson_tgt_dir, env=None)
+    repo_dir: DirectoryPath = Field(default_factory=lambda: conventions().repo_dir, env=None)
+
+    dev_dir: Path = Field(default_factory=lambda: conventions().dev_dir, env=None)
+    stg_dir: Path = Field(default_factory=lambda: conventions().stg_dir, env=None)
+    prd_dir: Path = Field(default_factory=lambda: conventions().prd_dir, env=None)
+
+    dev_fson_tgt_dir: Path = Field(default_factory=lambda: conventions().dev_fson_tgt_dir, env=None)
+    build_fson_tgt_dir: Path = Field(default_factory=lambda: conventions().build_fson_tgt_dir, env=None)
+
+    def odoo_addon_dirs(self) -> List[Path]:
+        """ Returns the addons of odoo itself (odoo/addons/* and addons/* of core_odoo_dir) """
+        return find_addons([self.core_odoo_dir / 'odoo' / 'addons' / '*', self.core_odoo_dir / 'addons' / '*'],
+                           manifest=self.cov.odoo_manifest_name, index_file=self.cov.addon_index_file)
+
+    def addon_dirs(self) -> List[Path]:
+        """ Returns the odoo, core and instance addons """
+        return self.odoo_addon_dirs() + (self.core_addon_dirs or []) + (self.inst_addon_dirs or [])
+
+    def addon_manifests(self) -> Dict[str, AddonManifest]:
+        """ Returns the (cached) manifest metadata of all addons """
+        return addon_manifests(self.addon_dirs(), cache_file=self.cov.manifest_cache_file,
+                               manifest=self.cov.odoo_manifest_name)
+
+    def addon_graph(self) -> AddonGraph:
+        """ Returns the dependency graph of all addons """
+        return AddonGraph.from_manifests(self.addon_manifests())
+
+    def addons_to_install(self) -> List[str]:
+        """ Returns the core and instance addons to install without duplicates """
+        return list(dict.fromkeys(self.core_addons_to_install + self.inst_addons_to_install))
+
+    def needed_addons(self, graph: Optional[AddonGraph] = None) -> Set[str]:
+        """ Returns the dependency closure of the addons to install and the server wide addons """
+        graph = graph or self.addon_graph()
+        roots = self.addons_to_install()
+        if not roots:
+            raise ValueError("No addons to install configured (CORE_ADDONS_TO_INSTALL, INST_ADDONS_TO_INSTALL)")
+        needed = graph.closure(roots + self.cov.odoo_server_wide_addons)
+        missing = {name for name in needed if name not in graph}
+        if missing:
+            logger.warning(f"Needed addons not found: {', '.join(sorted(missing))}")
+        return needed
 
     class Config:
         allow_mutation = True
 
 
+@trace.traced
 def fsonline_env(**kwargs) -> FsonlineEnv:
     env = FsonlineEnv(**kwargs)
     return env
 
+
+def fsonline_envs(envs: Iterable[ALLOWED_ENVIRONMENTS] = get_args(ALLOWED_ENVIRONMENTS),
+                  **kwargs) -> Dict[str, FsonlineEnv]:
+    """ Resolve the settings of several environments (default: DEV, STG and PRD) in parallel
+
+    The resolution of the settings shares no mutable state, so it is safe to run it in threads. Every job runs in a
+    copy of the caller's context, so the jobs see the conventions of the caller (see use_conventions()).
+
+    :return: {env: FsonlineEnv} in the order of envs
+    """
+    envs = list(envs)
+    contexts = [contextvars.copy_context() for _ in envs]
+    resolve = trace.inherit(lambda e: fsonline_env(**{**kwargs, 'env': e}))
+    with ThreadPoolExecutor(max_workers=len(envs) or 1) as executor:
+        return dict(zip(envs, executor.map(lambda ctx, e: ctx.run(resolve, e), contexts, envs)))
+
+
+ENV_CACHE_VERSION = 2
+# Environment variables that the defaults of the settings depend on (see Conventions.git_mirror_dir)
+ENV_CACHE_DEFAULT_VARS = ('HOME', 'XDG_CACHE_HOME')
+
+
+@trace.traced
+def _env_cache_key(kwargs: dict) -> str:
+    """ Returns a hash of everything the settings are resolved from
+
+    - the content and mtime of all possible env files of all environments
+    - the os environment variables of all settings fields and of the defaults (ENV_CACHE_DEFAULT_VARS)
+    - the kwargs
+    - the mtime of the settings code itself
+    """
+    cov = conventions()
+    key = hashlib.blake2b(digest_size=20)
+    key.update(f"{ENV_CACHE_VERSION}\0{sorted((k, str(v)) for k, v in kwargs.items())}\0".encode())
+
+    env_files = set()
+    for target_env in get_args(ALLOWED_ENVIRONMENTS):
+        env_files.update(env_file_candidates(target_env, [cov.core_env_file, cov.inst_env_file]))
+    for f in sorted(env_files) + [Path(__file__), Path(helper.__file__)]:
+        try:
+            key.update(f"{f}\0{os.stat(f).st_mtime_ns}\0".encode())
+            key.update(hashlib.blake2b(f.read_bytes(), digest_size=20).digest())
+        except FileNotFoundError:
+            key.update(f"{f}\0-\0".encode())
+
+    env_names = {'fsonline_environment'} | {name.lower() for name in ENV_CACHE_DEFAULT_VARS}
+    for field in FsonlineEnv.__fields__.values():
+        env_names.update(field.field_info.extra.get('env_names', ()))
+    key.update(str(sorted((k, v) for k, v in os.environ.items() if k.lower() in env_names)).encode())
+    return key.hexdigest()
+
+
+def _addon_search_state(settings: FsonlineEnv) -> Dict[str, Optional[int]]:
+    state = addon_search_roots(settings.core_addon_src, settings.core_dir) if settings.core_addon_src else {}
+    if settings.inst_addon_src:
+        state.update(addon_search_roots(settings.inst_addon_src, settings.inst_dir))
+    return state
+
+
+@trace.traced
+def cached_fsonline_env(**kwargs) -> FsonlineEnv:
+    """ Returns the FsonlineEnv from the cache file if nothing it depends on changed since it was cached
+
+    Resolving the settings merges and parses the env files twice, runs all validators and searches the addons.
+    The cached settings are used as long as the cache key (see _env_cache_key()) is the same and no addon
+    search root changed. The key is stored in a header line in front of the pickle, so a cache of another key (or
+    code version) is never unpickled. A cache that can not be read is rebuilt. Set FSONLINE_ENV_CACHE=0 to disable
+    the cache.
+    """
+    if os.environ.get('FSONLINE_ENV_CACHE', '1') == '0':
+        return fsonline_env(**kwargs)
+
+    cache_file = conventions().env_cache_file
+    key = _env_cache_key(kwargs)
+    header = f"fsonline-env-cache {key}\n".encode()
+    try:
+        with open(cache_file, 'rb') as f:
+            if f.readline() == header:
+                cached = pickle.load(f)
+                settings: FsonlineEnv = cached['settings']
+                if _addon_search_state(settings) == cached['addon_search_state']:
+                    trace.count('env_cache.hit')
+                    return settings
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.debug(f"Rebuild the settings cache '{cache_file}': {e!r}")
+
+    trace.count('env_cache.miss')
+    settings = fsonline_env(**kwargs)
+    atomic_write(cache_file, header + pickle.dumps(
+        {'settings': settings, 'addon_search_state': _addon_search_state(settings)}))
+    return settings
+
@@ -1,21 +1,23 @@
 import io
-from glob import glob
+import json
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatchcase
 from pathlib import Path
-from typing import Literal, List, Dict, Optional
-from pydantic import DirectoryPath
+from typing import Any, Literal, List, Dict, Optional, NamedTuple, Sequence
 from collections import OrderedDict
 from functools import wraps
+import threading
 import time
 import os
 from .globals import ALLOWED_ENVIRONMENTS
+from . import trace
 import logging
 
 logger = logging.getLogger(__name__)
 
 
-def merge_env_files(target_env: Optional[ALLOWED_ENVIRONMENTS], env_files: List[Path]) -> io.StringIO:
-    merged_files = io.StringIO()
-
+def env_file_candidates(target_env: Optional[ALLOWED_ENVIRONMENTS], env_files: List[Path]) -> List[Path]:
+    """ Returns all possible env files in merge order: *.env > *.env.local > *.env.[env] > *.env.[env].local """
     file_list = []
     for file in env_files:
         if not isinstance(file, Path):
@@ -25,17 +27,144 @@ def merge_env_files(target_env: Optional[ALLOWED_ENVIRONMENTS], env_files: List[
         if target_env:
             file_list.append(file.with_name(file.name + '.' + target_env.lower()))
             file_list.append(file.with_name(file.name + '.' + target_env.lower() + '.local'))
+    return file_list
+
+
+def _decode_env_value(value: Optional[str]) -> Any:
+    """ Decode JSON lists and dicts (complex settings types) and keep all other values as strings """
+    if value and value.lstrip()[:1] in ('[', '{'):
+        try:
+            return json.loads(value)
+        except ValueError:
+            pass
+    return value
+
 
-    for f in file_list:
-        if not f.is_file():
+def merge_env_files(target_env: Optional[ALLOWED_ENVIRONMENTS], env_files: List[Path]) -> Dict[str, Any]:
+    """ Returns the merged and parsed key/value pairs of the env files. Later files override earlier ones.
+
+    Values of complex types (lists, dicts) are decoded from JSON here, once, so they can be passed to the settings
+    classes directly.
+    """
+    # Imported here to keep the import of the helpers (and of the invoke tasks) cheap
+    from dotenv import dotenv_values
+
+    merged: Dict[str, Any] = {}
+    for f in env_file_candidates(target_env, env_files):
+        try:
+            content = f.read_text()
+        except (FileNotFoundError, IsADirectoryError):
             continue
-        merged_files.write(f.read_text())
+        for key, value in dotenv_values(stream=io.StringIO(content)).items():
+            merged[key] = _decode_env_value(value)
+    return merged
+
+
+ADDON_INDEX_VERSION = 1
+
+# Addon discovery is I/O bound (stat and readdir release the GIL) so we use more threads than cores
+DISCOVERY_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+
+def _glob_has_magic(part: str) -> bool:
+    return any(c in part for c in '*?[')
+
+
+def _search_root(search_path: Path) -> Path:
+    """ Returns the deepest directory of a search path that contains no glob wildcards
+
+    A change in the content of this directory (mtime) is what may change the result of globbing the search path.
+    For search paths without any wildcards the parent directory is returned.
+    """
+    parts = search_path.parts
+    for i, part in enumerate(parts):
+        if _glob_has_magic(part):
+            return Path(*parts[:i])
+    return search_path.parent
+
+
+def addon_search_roots(search_paths: List[Path], start_dir: Path) -> Dict[str, Optional[int]]:
+    """ Returns the mtime of the search root of every search path. The addons found can only change with them. """
+    roots = [_search_root(p if p.is_absolute() else start_dir / p) for p in search_paths]
+    return {str(root): _mtime_ns(root) for root in roots}
+
+
+def _mtime_ns(path: Path) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _scan_search_path(search_path: Path, manifest: str) -> List[Path]:
+    """ Returns all directories matching the search path (globbing supported) that contain the manifest file
+
+    Uses os.scandir() level by level starting at the search root. The d_type cached in the DirEntry makes the
+    directory checks free for everything but symlinks. Matches are sorted by name to get a deterministic order.
+    Like glob(), wildcards do not match hidden entries unless the pattern itself starts with a dot.
+    """
+    root = _search_root(search_path)
+    candidates: List[str] = [str(root)]
+    for part in search_path.parts[len(root.parts):]:
+        matches: List[str] = []
+        for directory in candidates:
+            if not _glob_has_magic(part):
+                path = os.path.join(directory, part)
+                if os.path.isdir(path):
+                    matches.append(path)
+                continue
+            trace.count('fs.scandir')
+            try:
+                with os.scandir(directory) as entries:
+                    found = [entry.path for entry in entries
+                             if fnmatchcase(entry.name, part)
+                             and (part.startswith('.') or not entry.name.startswith('.'))
+                             and entry.is_dir()]
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            matches.extend(sorted(found))
+        candidates = matches
+
+    return [Path(d) for d in candidates if os.path.isfile(os.path.join(d, manifest))]
+
+
+def atomic_write(path: Path, data: bytes):
+    """ Write data to path via a temporary file and os.replace(), safe for concurrent writers in threads and
+    processes: readers see either the old or the new content, the last writer wins.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        tmp_file.write_bytes(data)
+        os.replace(tmp_file, path)
+    finally:
+        if tmp_file.exists():
+            tmp_file.unlink()
+
+
+def load_addon_index(index_file: Path, manifest: str) -> Dict[str, dict]:
+    """ Returns the cached search path entries of the addon index or an empty dict if the index is unusable """
+    try:
+        index = json.loads(index_file.read_text())
+    except (FileNotFoundError, ValueError):
+        return {}
+    if index.get('version') != ADDON_INDEX_VERSION or index.get('manifest') != manifest:
+        return {}
+    return index.get('search_paths', {})
 
-    merged_files.seek(0)
-    return merged_files
 
+def save_addon_index(index_file: Path, manifest: str, search_paths: Dict[str, dict]):
+    """ Atomically write the addon index to index_file """
+    atomic_write(index_file, json.dumps({
+        'version': ADDON_INDEX_VERSION,
+        'manifest': manifest,
+        'search_paths': search_paths,
+    }, indent=1).encode())
 
-def find_addons(search_paths: List[Path], start_dir: Path = None, manifest="__manifest__.py") -> List[DirectoryPath]:
+
+@trace.traced
+def find_addons(search_paths: List[Path], start_dir: Path = None, manifest="__manifest__.py",
+                index_file: Optional[Path] = None, workers: Optional[int] = None) -> List[Path]:
     """ Returns a set of addon paths
 
     :param start_dir:
@@ -47,6 +176,15 @@ def find_addons(search_paths: List[Path], start_dir: Path = None, manifest="__ma
     :param str manifest:
         Name of the manifest files to identify an odoo-addon-folder
 
+    :param Path index_file:
+        Optional json file to cache the found addons per search path. Each entry records the mtime of the search
+        root (the deepest directory without wildcards). Only search paths whose root changed are scanned again.
+        ATTENTION: Adding a manifest to an already existing subdirectory does not change the mtime of the search
+                   root. Delete the index_file to force a full rescan in this case.
+
+    :param int workers:
+        Maximum number of threads used to scan the search paths in parallel. Defaults to DISCOVERY_WORKERS.
+
     :return: dict[str, Path]:
         Dict with addon name as key and the absolute addon path as value
     """
@@ -61,23 +199,46 @@ def find_addons(search_paths: List[Path], start_dir: Path = None, manifest="__ma
         assert all(p.is_absolute for p in search_paths), "All search paths must be absolute if no start_dir is set!"
         absolute_search_paths = search_paths
 
-    # Resolve any wildcards (globbing) in the absolute_search_paths to its individual files
-    addon_dirs: List[Path] = []
-    for abs_s_path in absolute_search_paths:
-        for f in glob(str(abs_s_path)):
-            f = Path(f)
-            if f.is_dir():
-                addon_dirs.append(f)
+    # Load the cached results of the last scan
+    cached = load_addon_index(index_file, manifest) if index_file else {}
+
+    # Get the search paths that must be scanned (again) because their search root changed
+    roots = [_search_root(p) for p in absolute_search_paths]
+    results: List[Optional[List[Path]]] = [None] * len(absolute_search_paths)
+    stale: List[int] = []
+    for i, (abs_s_path, root) in enumerate(zip(absolute_search_paths, roots)):
+        entry = cached.get(str(abs_s_path))
+        if entry and entry['root'] == str(root) and entry['mtime_ns'] == _mtime_ns(root):
+            results[i] = [Path(d) for d in entry['addon_dirs']]
+        else:
+            stale.append(i)
 
-    # Search all the found files for directories containing the manifest file
-    addons: OrderedDict[str, DirectoryPath] = OrderedDict()
+    # Resolve any wildcards (globbing) in the stale search paths in parallel and keep the dirs with a manifest file
+    if stale:
+        logger.debug(f"Scan addon search paths {[str(absolute_search_paths[i]) for i in stale]}")
+        # The mtime is taken before the scan so that changes during the scan invalidate the entry
+        mtimes = {i: _mtime_ns(roots[i]) for i in stale}
+        with ThreadPoolExecutor(max_workers=min(workers or DISCOVERY_WORKERS, len(stale))) as executor:
+            scanned = executor.map(trace.inherit(lambda i: _scan_search_path(absolute_search_paths[i], manifest)),
+                                   stale)
+            for i, found in zip(stale, scanned):
+                results[i] = found
+                cached[str(absolute_search_paths[i])] = {
+                    'root': str(roots[i]), 'mtime_ns': mtimes[i], 'addon_dirs': [str(d) for d in found]}
+
+    addon_dirs: List[Path] = [addon_dir for found in results for addon_dir in found]
+
+    if index_file and stale:
+        save_addon_index(index_file, manifest, cached)
+
+    # Check for addons found at different locations
+    addons: OrderedDict[str, Path] = OrderedDict()
     for addon_dir in addon_dirs:
-        if (addon_dir / manifest).is_file():
-            addon_name = addon_dir.name
-            if addon_name in addons:
-                assert addons[addon_name] == addon_dir, (
-                    f"Addon '{addon_name}' set twice at different locations: '{addon_dir}' and '{addons[addon_name]}'")
-            addons[addon_name] = addon_dir
+        addon_name = addon_dir.name
+        if addon_name in addons:
+            assert addons[addon_name] == addon_dir, (
+                f"Addon '{addon_name}' set twice at different locations: '{addon_dir}' and '{addons[addon_name]}'")
+        addons[addon_name] = addon_dir
 
     return list(addons.values())
 
@@ -96,20 +257,131 @@ def find_addons(search_paths: List[Path], start_dir: Path = None, manifest="__ma
 #             target.symlink_to(relative_source)
 
 
-def symlink_rel(source: Path, target: Path, dry=False):
-    rel_source = Path(os.path.relpath(source, target.parent))
+class FsOp(NamedTuple):
+    """ A single planned file system operation. Use FsOp._asdict() to serialise it. """
+    op: Literal['mkdir', 'unlink', 'symlink']
+    path: Path
+    source: Optional[str] = None
+    mode: Optional[int] = None
+
+    def __str__(self):
+        """ One readable line, e.g. 'symlink <path> -> <relative source>' """
+        return f"{self.op} {self.path}" + (f" -> {self.source}" if self.source else "")
+
+
+# The operations of a plan are executed in this order. All operations of a phase are independent of each other.
+FS_OP_PHASES = ('mkdir', 'unlink', 'symlink')
+FS_OP_BATCH_SIZE = 256
+
+
+def symlink_rel(source: Path, target: Path) -> FsOp:
+    """ Returns the operation to create a symlink at target that points relative to source """
+    rel_source = os.path.relpath(source, target.parent)
+    return FsOp('symlink', target, rel_source)
+
+
+def read_symlinks(dirs: List[Path]) -> Dict[Path, str]:
+    """ Returns the targets (os.readlink) of all symlinks directly inside the given directories """
+    existing: Dict[Path, str] = {}
+    for d in dirs:
+        try:
+            with os.scandir(d) as entries:
+                for entry in entries:
+                    if entry.is_symlink():
+                        existing[Path(entry.path)] = os.readlink(entry.path)
+        except FileNotFoundError:
+            continue
+    return existing
+
+
+@trace.traced
+def plan_symlinks(dirs: List[Path], links: Dict[Path, Path], mode=0o770, clean=False, update=False,
+                  parents: Sequence[Path] = ()) -> List[FsOp]:
+    """ Returns the operations to create the directories and the symlinks
+
+    :param dirs: The directories (parents first) that hold the links
+    :param links: The wanted symlinks as {target: source}. The parent of each target must be in dirs.
+    :param clean: Remove all existing symlinks in dirs and create all links again
+    :param update: Reconcile the existing symlinks in dirs (read with os.readlink) with the wanted links. Only
+                   missing links are created, links with a different source are replaced and links that are not
+                   wanted are removed. Files and directories that are not symlinks are never touched.
+    :param parents: Directories to create before dirs. Their content is never touched.
+    """
+    plan: List[FsOp] = [FsOp('mkdir', d, mode=mode) for d in list(parents) + list(dirs)]
+    wanted: List[FsOp] = [symlink_rel(source=src, target=tgt) for tgt, src in links.items()]
+    if not (clean or update):
+        return plan + wanted
+
+    existing = read_symlinks(dirs)
+    for op in list(wanted):
+        if op.path.exists() and not op.path.is_symlink():
+            logger.warning(f"Skip '{op.path}' because it exists and is not a symlink")
+            wanted.remove(op)
+    if clean:
+        return plan + [FsOp('unlink', tgt) for tgt in existing] + wanted
+
+    wanted_targets = {op.path for op in wanted}
+    plan += [FsOp('unlink', tgt) for tgt in existing if tgt not in wanted_targets]
+    for op in wanted:
+        current = existing.get(op.path)
+        if current == op.source:
+            continue
+        if current is not None:
+            plan.append(FsOp('unlink', op.path))
+        plan.append(op)
+    return plan
+
+
+def plan_changes(plan: List[FsOp]) -> Dict[str, List[Path]]:
+    """ Returns the links that a plan 'created', 'retargeted' (unlinked and linked again) and 'removed' """
+    unlinked = {op.path for op in plan if op.op == 'unlink'}
+    linked = {op.path for op in plan if op.op == 'symlink'}
+    return {'created': [op.path for op in plan if op.op == 'symlink' and op.path not in unlinked],
+            'retargeted': [op.path for op in plan if op.op == 'symlink' and op.path in unlinked],
+            'removed': [op.path for op in plan if op.op == 'unlink' and op.path not in linked]}
+
+
+def _execute_ops(ops: List[FsOp]):
+    for op in ops:
+        if op.op == 'symlink':
+            os.symlink(op.source, op.path)
+        elif op.op == 'unlink':
+            os.unlink(op.path)
+        elif op.op == 'mkdir':
+            op.path.mkdir(mode=op.mode if op.mode is not None else 0o777, exist_ok=True)
+        else:
+            raise ValueError(f"Unknown file system operation '{op.op}'")
+
+
+@trace.traced
+def execute_plan(plan: List[FsOp], workers: Optional[int] = None, batch_size: int = FS_OP_BATCH_SIZE):
+    """ Execute the operations of a plan
+
+    The plan is executed phase by phase (see FS_OP_PHASES). Directories are created in plan order. Unlinks and
+    symlinks are split into batches that run in parallel in a thread pool. The syscalls release the GIL.
+    """
+    by_phase: Dict[str, List[FsOp]] = {phase: [] for phase in FS_OP_PHASES}
+    for op in plan:
+        by_phase[op.op].append(op)
 
-    logger.debug(f"Create symlink at '{target}' from '{rel_source}'")
-    if not dry:
-        target.symlink_to(rel_source)
+    for phase, ops in by_phase.items():
+        trace.count(f"fs.{phase}", len(ops))
+    _execute_ops(by_phase['mkdir'])
+    with ThreadPoolExecutor(max_workers=workers or DISCOVERY_WORKERS) as executor:
+        for phase in FS_OP_PHASES[1:]:
+            ops = by_phase[phase]
+            batches = [ops[i:i + batch_size] for i in range(0, len(ops), batch_size)]
+            # list() to wait for the phase to finish and to raise the first error
+            list(executor.map(_execute_ops, batches))
 
 
 def log_time(func):
-    """This decorator prints the execution time for the decorated function."""
+    """This decorator prints the execution time for the decorated function and traces it as a span (see trace)."""
     @wraps(func)
     def wrapper(*args, **kwargs):
         start = time.time()
-        result = func(*args, **kwargs)
+        with trace.span(func.__name__):
+            result = func(*args, **kwargs)
         end = time.time()
         logger.info("{} ran in {}s".format(func.__name__, round(end - start, 2)))
         return result
@@ -0,0 +1,103 @@
+import os
+import subprocess
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+from .submodules import run_git
+from . import trace
+import logging
+
+logger = logging.getLogger(__name__)
+
+GITLINK_MODE = '160000'
+NULL_SHA = '0' * 40
+
+
+def _split_z(output: str) -> List[str]:
+    return [p for p in output.split('\0') if p]
+
+
+# A changed path of 'git diff --raw': (old mode, new mode, old sha, new sha, path)
+DiffEntry = Tuple[str, str, str, str, str]
+
+
+def _diff_entries(repo_dir: Path, *revs: str) -> List[DiffEntry]:
+    fields = _split_z(run_git(repo_dir, 'diff', '--raw', '-z', '--no-abbrev', '--no-renames', *revs,
+                              check=True, merge_stderr=False).stdout)
+    # --raw -z output: ':<old mode> <new mode> <old sha> <new sha> <status>' NUL '<path>' NUL
+    entries = []
+    for info, path in zip(fields[::2], fields[1::2]):
+        old_mode, new_mode, old_sha, new_sha, _status = info.lstrip(':').split(' ')
+        entries.append((old_mode, new_mode, old_sha, new_sha, path))
+    return entries
+
+
+def _tree_entries(repo_dir: Path, rev: str) -> List[DiffEntry]:
+    """ Returns all paths of a commit as added entries """
+    # ls-tree -z output: '<mode> <type> <sha>' TAB '<path>' NUL
+    entries = []
+    for line in _split_z(run_git(repo_dir, 'ls-tree', '-r', '-z', rev, check=True, merge_stderr=False).stdout):
+        info, path = line.split('\t', 1)
+        mode, _type, sha = info.split(' ')
+        entries.append(('000000', mode, NULL_SHA, sha, path))
+    return entries
+
+
+def _entry_files(repo_dir: Path, entries: List[DiffEntry]) -> List[Path]:
+    """ Returns the changed files of the entries, the changed submodules (gitlinks) expanded recursively """
+    files: List[Path] = []
+    for old_mode, new_mode, old_sha, new_sha, path in entries:
+        if GITLINK_MODE not in (old_mode, new_mode):
+            files.append(repo_dir / path)
+            continue
+        submodule_dir = repo_dir / path
+        if new_sha == NULL_SHA or not (submodule_dir / '.git').exists():
+            # Removed or not initialized submodule: only the gitlink itself changed
+            files.append(submodule_dir)
+            continue
+        try:
+            if old_sha == NULL_SHA:
+                raise subprocess.CalledProcessError(1, 'git diff')
+            sub_entries = _diff_entries(submodule_dir, old_sha, new_sha)
+        except subprocess.CalledProcessError:
+            logger.warning(f"Can not diff '{submodule_dir}' from {old_sha[:8]}: all files of {new_sha[:8]} count as "
+                           f"changed")
+            sub_entries = _tree_entries(submodule_dir, new_sha)
+        files += _entry_files(submodule_dir, sub_entries)
+    return files
+
+
+@trace.traced
+def changed_files(repo_dir: Path, rev_range: str) -> List[Path]:
+    """ Returns the absolute paths of all files changed in the revision range, including files in submodules
+
+    A single revision 'A' is the same as 'A..HEAD'. For every changed submodule (gitlink) the files that changed
+    between the old and the new submodule commit are listed, and so on for the submodules of the submodule. This
+    needs the old commit in the submodule; if it is missing all files of the new commit are listed. Raises
+    subprocess.CalledProcessError if the revision range does not resolve in repo_dir.
+    """
+    if '..' not in rev_range:
+        rev_range = f"{rev_range}..HEAD"
+    return _entry_files(repo_dir, _diff_entries(repo_dir, rev_range))
+
+
+def owning_addons(files: Iterable[Path], addon_dirs: Iterable[Path]) -> Dict[str, List[Path]]:
+    """ Returns the changed files per addon as {addon_name: [files]}. Files outside of all addons are skipped. """
+    by_dir: Dict[str, str] = {os.path.normpath(str(d)): d.name for d in addon_dirs}
+    changed: Dict[str, List[Path]] = {}
+    for f in files:
+        path = os.path.normpath(str(f))
+        # Walk up the parents until an addon directory is found
+        while True:
+            name = by_dir.get(path)
+            if name:
+                changed.setdefault(name, []).append(f)
+                break
+            parent = os.path.dirname(path)
+            if parent == path:
+                break
+            path = parent
+    return changed
+
+
+def is_inside(path: Path, directory: Path) -> bool:
+    return os.path.normpath(str(path)).startswith(os.path.normpath(str(directory)) + os.sep)
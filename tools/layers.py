@@ -0,0 +1,154 @@
+""" Group the odoo tree into docker layers by volatility
+
+Every COPY of a Dockerfile is a layer and a change in a layer rebuilds it and all layers after it. So the odoo tree
+is split into groups that are copied one after the other, the least volatile first: the odoo framework, the odoo
+addons, the addons of every submodule (e.g. OCA/web) and last the own addons of the core and instance repository.
+The order of the submodule groups comes either from their path or from their git churn (the number of commits that
+changed them in the repository).
+"""
+import re
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+from .build_context import append_to_dockerfile
+from .impact import is_inside
+from .submodules import read_gitmodules, run_git
+from . import trace
+import logging
+
+logger = logging.getLogger(__name__)
+
+LAYER_ORDERS = ('submodule', 'churn')
+# Docker allows 127 layers per image, the base image needs some of them
+MAX_LAYERS = 32
+ODOO_GROUP = 'odoo'
+ODOO_ADDONS_GROUP = 'odoo-addons'
+CHURN_SINCE = '1 year ago'
+
+
+class LayerGroup(NamedTuple):
+    name: str
+    # The repository of the group (submodule or core/instance repository)
+    repo_dir: Path
+    # Paths in repo_dir that changes of the group are counted for (see git_churn())
+    paths: List[str]
+    # target: source of the odoo tree (see dev.fson_links())
+    links: Dict[Path, Path]
+
+
+def _group_name(path: str) -> str:
+    return re.sub(r'[^A-Za-z0-9._-]+', '-', path).strip('-').lower()
+
+
+def layer_groups(links: Dict[Path, Path], tgt_dir: Path, odoo_dir: Path, repo_dirs: List[Path]) -> List[LayerGroup]:
+    """ Returns the links of the odoo tree grouped by the repository of their source in 'submodule' order
+
+    :param links: target: source of the odoo tree in tgt_dir (see dev.fson_links())
+    :param odoo_dir: The odoo sources (core_odoo_dir)
+    :param repo_dirs: The core and instance repository. Addons in their submodules are grouped by submodule, other
+                      addons by repository ('core' and 'instance')
+    """
+    addons_dir = tgt_dir / 'odoo' / 'addons'
+    # The deepest submodules first, e.g. nested submodules before their parent. The core repository can be a
+    # submodule of the instance repository.
+    submodules = sorted(((repo_dir, repo_dir / s.path) for repo_dir in repo_dirs for s in read_gitmodules(repo_dir)
+                         if repo_dir / s.path not in repo_dirs),
+                        key=lambda s: len(s[1].parts), reverse=True)
+
+    def repo_of(source: Path) -> Path:
+        return next((r for r in sorted(repo_dirs, key=lambda r: len(r.parts), reverse=True) if is_inside(source, r)),
+                    repo_dirs[0])
+
+    odoo_repo = repo_of(odoo_dir)
+    odoo_path = [str(odoo_dir.relative_to(odoo_repo))] if is_inside(odoo_dir, odoo_repo) else []
+    odoo = {ODOO_GROUP: LayerGroup(ODOO_GROUP, odoo_repo, odoo_path, OrderedDict()),
+            ODOO_ADDONS_GROUP: LayerGroup(ODOO_ADDONS_GROUP, odoo_repo, odoo_path, OrderedDict())}
+    groups: Dict[str, LayerGroup] = {}
+    own: Dict[str, LayerGroup] = OrderedDict()
+    for target, source in links.items():
+        if target.parent != addons_dir:
+            group = odoo[ODOO_GROUP]
+        elif is_inside(source, odoo_dir):
+            group = odoo[ODOO_ADDONS_GROUP]
+        else:
+            submodule = next(((r, s) for r, s in submodules if is_inside(source, s)), None)
+            if submodule:
+                repo_dir, submodule_dir = submodule
+                path = str(submodule_dir.relative_to(repo_dir))
+                group = groups.setdefault(_group_name(path), LayerGroup(_group_name(path), repo_dir, [path],
+                                                                        OrderedDict()))
+            else:
+                repo_dir = repo_of(source)
+                name = 'core' if repo_dir == repo_dirs[0] else 'instance'
+                group = own.setdefault(name, LayerGroup(name, repo_dir, [], OrderedDict()))
+                group.paths.append(str(source.relative_to(repo_dir)))
+        group.links[target] = source
+
+    return ([g for g in odoo.values() if g.links] + [groups[name] for name in sorted(groups)]
+            + [own[name] for name in ('core', 'instance') if name in own])
+
+
+def git_churn(repo_dir: Path, paths: List[str], since: str = CHURN_SINCE) -> int:
+    """ Returns the number of commits since the given date that changed any of the paths in repo_dir """
+    if not paths:
+        return 0
+    proc = run_git(repo_dir, 'rev-list', '--count', f"--since={since}", 'HEAD', '--', *paths, merge_stderr=False)
+    if proc.returncode != 0:
+        logger.warning(f"Can not count the commits of {paths} in '{repo_dir}': {proc.stderr.strip()}")
+        return 0
+    return int(proc.stdout.strip() or 0)
+
+
+@trace.traced
+def order_groups(groups: List[LayerGroup], order: str = 'submodule', max_layers: int = MAX_LAYERS,
+                 since: str = CHURN_SINCE) -> List[LayerGroup]:
+    """ Returns the groups in layer order, the last groups merged into one if there are more than max_layers
+
+    :param order: 'submodule': odoo, odoo addons, submodules by path, own addons (see layer_groups())
+                  'churn': like 'submodule' but the submodule groups by their number of commits since 'since'
+    """
+    if order not in LAYER_ORDERS:
+        raise ValueError(f"Unknown layer order '{order}', use one of {LAYER_ORDERS}")
+    if order == 'churn':
+        odoo = [g for g in groups if g.name in (ODOO_GROUP, ODOO_ADDONS_GROUP)]
+        submodules = [g for g in groups if g not in odoo and g.name not in ('core', 'instance')]
+        own = [g for g in groups if g.name in ('core', 'instance')]
+        churn = {g.name: git_churn(g.repo_dir, g.paths, since) for g in submodules}
+        logger.debug(f"Churn of the layer groups since {since}: {churn}")
+        # sorted() is stable: groups with the same churn keep their path order
+        groups = odoo + sorted(submodules, key=lambda g: churn[g.name]) + own
+
+    if len(groups) > max_layers:
+        last = groups[max_layers - 1:]
+        merged = OrderedDict((t, s) for g in last for t, s in g.links.items())
+        groups = groups[:max_layers - 1] + [LayerGroup('+'.join(g.name for g in last), last[-1].repo_dir,
+                                                       [p for g in last for p in g.paths], merged)]
+    return groups
+
+
+def layered_dockerfile(base: str, layer_dirs: List[str], image_dir: str, after: Optional[List[str]] = None) -> str:
+    """ Returns the base Dockerfile with a COPY of every layer directory of the build context to image_dir
+
+    :param after: An instruction per layer that follows its COPY (e.g. to precompile the layer)
+    """
+    copies = '\n'.join(f"COPY {layer_dir}/ {image_dir}/" + (f"\n{after[i]}" if after and after[i] else '')
+                       for i, layer_dir in enumerate(layer_dirs))
+    return append_to_dockerfile(base, f"# odoo and addons, the least volatile first\n{copies}")
+
+
+def layer_dir(index: int, group: LayerGroup) -> str:
+    return f"layers/{index:02d}-{group.name}"[:100]
+
+
+def layer_files(groups: List[LayerGroup], tgt_dir: Path, files_of) -> Dict[Path, Path]:
+    """ Returns the files of all groups as {path in the build context: source file}
+
+    :param files_of: Function that expands links to files (see materialise.tree_files())
+    """
+    files: Dict[Path, Path] = {}
+    for i, group in enumerate(groups):
+        prefix = Path(layer_dir(i, group))
+        for target, source in files_of(group.links).items():
+            files[prefix / target.relative_to(tgt_dir)] = source
+    return files
+
@@ -0,0 +1,167 @@
+import ast
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple, Iterable
+from .helper import atomic_write
+from . import trace
+import logging
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_CACHE_VERSION = 1
+
+# Parsing is CPU bound: below this number of manifests a process pool costs more than it saves
+PARALLEL_PARSE_MIN = 64
+
+
+class AddonManifest(NamedTuple):
+    """ The addon metadata of an odoo manifest file that is used by the tooling """
+    name: str
+    path: str
+    version: Optional[str]
+    depends: Tuple[str, ...]
+    external_dependencies: Dict[str, List[str]]
+    data: Tuple[str, ...]
+    installable: bool
+
+    def to_json(self) -> dict:
+        return self._asdict()
+
+    @classmethod
+    def from_json(cls, data: dict) -> 'AddonManifest':
+        return cls(**{**data, 'depends': tuple(data['depends']), 'data': tuple(data['data'])})
+
+
+def _str_list(value, key: str, name: str) -> Tuple[str, ...]:
+    """ Returns value as tuple of strings. Raises ValueError if it is no list or tuple of strings. """
+    if not isinstance(value, (list, tuple)) or not all(isinstance(v, str) for v in value):
+        raise ValueError(f"'{key}' in the manifest of addon '{name}' is not a list of strings: {value!r}")
+    return tuple(value)
+
+
+def parse_manifest(content: str, name: str, path: str = '') -> AddonManifest:
+    """ Returns the metadata of the manifest content
+
+    Raises ValueError for manifests that are no dict literal or whose depends, data or external_dependencies have
+    the wrong type.
+    """
+    try:
+        manifest = ast.literal_eval(content)
+    except (SyntaxError, ValueError) as e:
+        raise ValueError(f"Manifest of addon '{name}' is not a python literal: {e}")
+    if not isinstance(manifest, dict):
+        raise ValueError(f"Manifest of addon '{name}' is not a dict")
+    external_dependencies = manifest.get('external_dependencies', {})
+    if not isinstance(external_dependencies, dict):
+        raise ValueError(f"'external_dependencies' in the manifest of addon '{name}' is not a dict: "
+                         f"{external_dependencies!r}")
+    return AddonManifest(
+        name=name,
+        path=path,
+        version=manifest.get('version'),
+        depends=_str_list(manifest.get('depends', ()), 'depends', name),
+        external_dependencies={k: list(_str_list(v, f"external_dependencies.{k}", name))
+                               for k, v in external_dependencies.items()},
+        data=_str_list(manifest.get('data', ()), 'data', name),
+        installable=bool(manifest.get('installable', True)),
+    )
+
+
+def read_manifest(addon_dir: Path, manifest: str = "__manifest__.py") -> AddonManifest:
+    return parse_manifest((addon_dir / manifest).read_text(), name=addon_dir.name, path=str(addon_dir))
+
+
+def _read_manifest_or_error(args: Tuple[str, str]):
+    addon_dir, manifest = args
+    try:
+        return read_manifest(Path(addon_dir), manifest)
+    except (OSError, ValueError) as e:
+        return str(e)
+
+
+def _stat_key(path: str) -> Optional[List[int]]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [st.st_mtime_ns, st.st_size, st.st_ino]
+
+
+class ManifestStore:
+    """ Addon metadata of odoo manifests, cached in a json file and keyed by the stat of the manifest files
+
+    Only manifests whose mtime, size or inode changed since the last call are parsed again. Many changed
+    manifests are parsed in parallel in a process pool.
+    """
+
+    def __init__(self, cache_file: Optional[Path] = None, manifest: str = "__manifest__.py"):
+        self.cache_file = cache_file
+        self.manifest = manifest
+        self._entries: Dict[str, dict] = self._load()
+        self._changed = False
+
+    def _load(self) -> Dict[str, dict]:
+        if not self.cache_file:
+            return {}
+        try:
+            cache = json.loads(self.cache_file.read_text())
+        except (FileNotFoundError, ValueError):
+            return {}
+        if cache.get('version') != MANIFEST_CACHE_VERSION or cache.get('manifest') != self.manifest:
+            return {}
+        return cache.get('entries', {})
+
+    def save(self):
+        """ Write the cache file if any manifest was parsed since the last save """
+        if not self.cache_file or not self._changed:
+            return
+        atomic_write(self.cache_file, json.dumps(
+            {'version': MANIFEST_CACHE_VERSION, 'manifest': self.manifest, 'entries': self._entries}).encode())
+        self._changed = False
+
+    @trace.traced
+    def get(self, addon_dirs: Iterable[Path], workers: Optional[int] = None) -> Dict[str, AddonManifest]:
+        """ Returns the metadata of the given addons as {addon_name: AddonManifest} in the order of addon_dirs
+
+        Addons with a missing or broken manifest are skipped with a warning.
+        """
+        addon_dirs = [str(d) for d in addon_dirs]
+        stats = {d: _stat_key(os.path.join(d, self.manifest)) for d in addon_dirs}
+        misses = [d for d in addon_dirs
+                  if stats[d] is not None and (self._entries.get(d) or {}).get('stat') != stats[d]]
+
+        if misses:
+            trace.count('manifest.parse', len(misses))
+            args = [(d, self.manifest) for d in misses]
+            if len(misses) >= PARALLEL_PARSE_MIN:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    parsed = list(executor.map(_read_manifest_or_error, args, chunksize=32))
+            else:
+                parsed = [_read_manifest_or_error(a) for a in args]
+            for d, result in zip(misses, parsed):
+                if isinstance(result, str):
+                    logger.warning(result)
+                    self._entries.pop(d, None)
+                    continue
+                self._entries[d] = {'stat': stats[d], 'meta': result.to_json()}
+            self._changed = True
+
+        result: Dict[str, AddonManifest] = {}
+        for d in addon_dirs:
+            entry = self._entries.get(d)
+            if stats[d] is None or not entry:
+                if stats[d] is None:
+                    logger.warning(f"Missing manifest in '{d}'")
+                continue
+            meta = AddonManifest.from_json(entry['meta'])
+            result[meta.name] = meta
+        self.save()
+        return result
+
+
+def addon_manifests(addon_dirs: Iterable[Path], cache_file: Optional[Path] = None,
+                    manifest: str = "__manifest__.py") -> Dict[str, AddonManifest]:
+    """ Returns the (cached) metadata of the given addons as {addon_name: AddonManifest} """
+    return ManifestStore(cache_file, manifest=manifest).get(addon_dirs)
@@ -0,0 +1,212 @@
+""" Materialise a tree of symlinks (e.g. the odoo tree of dev.symlink_odoo) as real files
+
+Docker can not follow symlinks that point outside of a bind mount or build context, so the build needs real
+files. Files are reflinked (copy on write, FICLONE) or hardlinked where the file system allows it and copied with
+copy_file_range() otherwise. A manifest with the hash of every materialised file makes a rebuild skip all unchanged
+files. The hashes are memoised by the stat of the sources (see content_hash.HashStore).
+"""
+import errno
+import fcntl
+import json
+import os
+import shutil
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from .helper import atomic_write, DISCOVERY_WORKERS
+from .content_hash import HashStore, IGNORED_DIRS, VCS_METADATA
+from . import trace
+import logging
+
+logger = logging.getLogger(__name__)
+
+MATERIALISE_MANIFEST_VERSION = 2
+# The methods to create a file in the order they are tried by 'auto'
+MATERIALISE_METHODS = ('reflink', 'hardlink', 'copy')
+# ioctl of linux/fs.h: clone the extents of a file (btrfs, xfs, ...)
+FICLONE = 0x40049409
+# Errors of a method that is not supported by the file system (or between file systems)
+UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.ENOSYS, errno.EPERM,
+                      errno.EMLINK, errno.EBADF}
+COPY_CHUNK_SIZE = 1 << 20
+
+
+class MaterialiseResult(NamedTuple):
+    # Number of files created per method
+    created: Dict[str, int]
+    skipped: int
+    removed: int
+
+
+def _stat_key(path: Path) -> Optional[List[int]]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [st.st_mtime_ns, st.st_size, st.st_ino]
+
+
+def _reflink(source: Path, target: Path):
+    with open(source, 'rb') as src, open(target, 'xb') as tgt:
+        fcntl.ioctl(tgt.fileno(), FICLONE, src.fileno())
+
+
+def _hardlink(source: Path, target: Path):
+    os.link(source, target)
+
+
+def _copy(source: Path, target: Path):
+    with open(source, 'rb') as src, open(target, 'xb') as tgt:
+        size = os.fstat(src.fileno()).st_size
+        try:
+            while size > 0:
+                copied = os.copy_file_range(src.fileno(), tgt.fileno(), size)
+                if copied == 0:
+                    break
+                size -= copied
+        except (AttributeError, OSError) as e:
+            # copy_file_range() is missing (not linux, python < 3.8) or not supported by the file system
+            if isinstance(e, OSError) and e.errno not in UNSUPPORTED_ERRNOS:
+                raise
+            src.seek(0)
+            tgt.seek(0)
+            tgt.truncate()
+            shutil.copyfileobj(src, tgt, COPY_CHUNK_SIZE)
+
+
+_METHODS = {'reflink': _reflink, 'hardlink': _hardlink, 'copy': _copy}
+
+
+def tree_files(links: Dict[Path, Path]) -> Dict[Path, Path]:
+    """ Returns every file below the links (target: source) as {target file: source file}
+
+    Links to directories are expanded recursively. Symlinks inside the sources are followed, so the result only
+    contains regular files. Version control and CI metadata (e.g. the .git of OCB) and __pycache__ are skipped.
+    """
+    files: Dict[Path, Path] = {}
+    for target, source in links.items():
+        if target.name in VCS_METADATA:
+            continue
+        if not source.is_dir():
+            files[target] = source
+            continue
+        for dirpath, dirnames, filenames in os.walk(source, followlinks=True):
+            dirnames[:] = [d for d in dirnames if d not in IGNORED_DIRS]
+            rel = os.path.relpath(dirpath, source)
+            target_dir = target if rel == '.' else target / rel
+            for name in filenames:
+                if name not in VCS_METADATA:
+                    files[target_dir / name] = Path(dirpath) / name
+    return files
+
+
+class Materialiser:
+    """ Create and update the real files of a tree from their sources
+
+    :param target_dir: The root of the tree. Only files below it are touched.
+    :param manifest_file: JSON file with the source, hash and target stat of every materialised file
+    :param method: 'auto' (reflink, else hardlink, else copy) or one of MATERIALISE_METHODS.
+                   ATTENTION: Hardlinks share the file with the source: never edit the materialised files.
+    :param hashes: The (cached) file hashes of the sources. Defaults to hashes memoised for this instance only.
+    """
+
+    def __init__(self, target_dir: Path, manifest_file: Path, method: str = 'auto',
+                 hashes: Optional[HashStore] = None):
+        if method != 'auto' and method not in MATERIALISE_METHODS:
+            raise ValueError(f"Unknown method '{method}', use 'auto' or one of {MATERIALISE_METHODS}")
+        self.target_dir = target_dir
+        self.manifest_file = manifest_file
+        self.methods: List[str] = list(MATERIALISE_METHODS if method == 'auto' else [method])
+        self.hashes = hashes or HashStore()
+        self._lock = threading.Lock()
+
+    def load(self) -> Dict[str, dict]:
+        try:
+            manifest = json.loads(self.manifest_file.read_text())
+        except (FileNotFoundError, ValueError):
+            return {}
+        if manifest.get('version') != MATERIALISE_MANIFEST_VERSION or manifest.get('target_dir') != str(
+                self.target_dir):
+            return {}
+        return manifest.get('files', {})
+
+    def save(self, files: Dict[str, dict]):
+        atomic_write(self.manifest_file, json.dumps({
+            'version': MATERIALISE_MANIFEST_VERSION, 'target_dir': str(self.target_dir), 'files': files}).encode())
+
+    def _create(self, source: Path, target: Path) -> str:
+        """ Create target from source with the first supported method. Unsupported methods are not tried again. """
+        for method in list(self.methods):
+            try:
+                _METHODS[method](source, target)
+                return method
+            except OSError as e:
+                if e.errno not in UNSUPPORTED_ERRNOS or len(self.methods) == 1:
+                    raise
+                with self._lock:
+                    if method in self.methods and len(self.methods) > 1:
+                        logger.debug(f"Materialise method '{method}' not supported: {e}")
+                        self.methods.remove(method)
+                if target.exists():
+                    target.unlink()
+        raise OSError(f"No materialise method left for '{target}'")
+
+    def _update(self, target: Path, source: Path, entry: Optional[dict]) -> Tuple[Optional[str], dict]:
+        """ Returns the method used to (re)create target (None if it was up to date) and its new manifest entry """
+        source_hash = self.hashes.file_hash(source)
+        if (entry and entry['source'] == str(source) and entry['hash'] == source_hash
+                and entry['target_stat'] == _stat_key(target)):
+            return None, entry
+
+        try:
+            target.unlink()
+        except FileNotFoundError:
+            pass
+        target.parent.mkdir(parents=True, exist_ok=True)
+        method = self._create(source, target)
+        if method != 'hardlink':
+            shutil.copymode(source, target)
+        trace.count(f"fs.{method}")
+        return method, {'source': str(source), 'hash': source_hash, 'target_stat': _stat_key(target)}
+
+    @trace.traced
+    def materialise(self, files: Dict[Path, Path], workers: Optional[int] = None) -> MaterialiseResult:
+        """ Make the files (target: source, see tree_files()) below target_dir real copies of their sources
+
+        Files that are unchanged since the last run are skipped. Files of the last run that are not in files anymore
+        are removed.
+        """
+        for target in files:
+            if self.target_dir not in target.parents:
+                raise ValueError(f"'{target}' is outside of the target dir '{self.target_dir}'")
+        old = self.load()
+        items = [(target, source, old.get(str(target.relative_to(self.target_dir)))) for target, source in
+                 files.items()]
+
+        with ThreadPoolExecutor(max_workers=workers or DISCOVERY_WORKERS) as executor:
+            updated = list(executor.map(trace.inherit(lambda item: self._update(*item)), items, chunksize=64))
+
+        created: Counter = Counter()
+        new: Dict[str, dict] = {}
+        for (target, _, _), (method, entry) in zip(items, updated):
+            new[str(target.relative_to(self.target_dir))] = entry
+            if method:
+                created[method] += 1
+
+        removed = [rel for rel in old if rel not in new]
+        for rel in removed:
+            try:
+                (self.target_dir / rel).unlink()
+            except FileNotFoundError:
+                pass
+        for directory in sorted({(self.target_dir / rel).parent for rel in removed}, reverse=True):
+            # Remove the directories that got empty
+            while directory != self.target_dir and directory.is_dir() and not any(directory.iterdir()):
+                directory.rmdir()
+                directory = directory.parent
+
+        self.save(new)
+        self.hashes.save()
+        return MaterialiseResult(dict(created), len(files) - sum(created.values()), len(removed))
@@ -0,0 +1,63 @@
+""" Byte-compile odoo and the addons ahead of time
+
+Without precompiled .pyc files every odoo start compiles hundreds of modules, and in a read-only image it does that
+on every start again. compileall runs with a worker pool. The pyc files must be compiled by the python version that
+runs odoo, so compileall runs with the given interpreter (e.g. the one of the image).
+
+The invalidation mode decides how python checks a pyc against its source:
+    'timestamp':      mtime and size of the source (stored in the pyc, so the pyc differs between builds)
+    'checked-hash':   hash of the source, reproducible but the source is read on every import
+    'unchecked-hash': not at all, reproducible and fastest: only for sources that never change (images)
+"""
+import shlex
+import subprocess
+from typing import List, Optional, Sequence
+from . import trace
+import logging
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_MODES = ('timestamp', 'checked-hash', 'unchecked-hash')
+# Python files below static/ are never imported by odoo (e.g. the python 2 build scripts of javascript libraries)
+PRECOMPILE_EXCLUDE = r'/static/'
+
+
+def compileall_command(paths: Sequence[str], python: str = 'python3', workers: int = 0,
+                       invalidation_mode: Optional[str] = None,
+                       exclude: Optional[str] = PRECOMPILE_EXCLUDE) -> List[str]:
+    """ Returns the compileall command for the paths (directories are compiled recursively)
+
+    :param workers: Number of worker processes, 0 for one per cpu
+    :param exclude: Regular expression of the paths to skip (compileall -x)
+    """
+    if invalidation_mode and invalidation_mode not in INVALIDATION_MODES:
+        raise ValueError(f"Unknown invalidation mode '{invalidation_mode}', use one of {INVALIDATION_MODES}")
+    command = [python, '-m', 'compileall', '-q', '-j', str(workers)]
+    if invalidation_mode:
+        command += ['--invalidation-mode', invalidation_mode]
+    if exclude:
+        command += ['-x', exclude]
+    return command + list(paths)
+
+
+@trace.traced
+def precompile(paths: Sequence[str], python: str = 'python3', workers: int = 0,
+               invalidation_mode: Optional[str] = None, exclude: Optional[str] = PRECOMPILE_EXCLUDE) -> bool:
+    """ Byte-compile the paths with the given python interpreter. Returns False if any file failed to compile. """
+    trace.count('subprocess')
+    proc = subprocess.run(compileall_command(paths, python, workers, invalidation_mode, exclude),
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    if proc.returncode != 0:
+        logger.warning(f"compileall failed:\n{proc.stdout.strip()}")
+    return proc.returncode == 0
+
+
+def precompile_instruction(paths: Sequence[str], python: str = 'python3', invalidation_mode: Optional[str] = None,
+                           exclude: Optional[str] = PRECOMPILE_EXCLUDE) -> str:
+    """ Returns a Dockerfile RUN instruction that byte-compiles the paths in the image, one path per line
+
+    The build fails if a file does not compile: skip files that are not meant to be imported with exclude.
+    """
+    command = compileall_command(paths, python, 0, invalidation_mode, exclude)
+    options, paths = command[:len(command) - len(paths)], command[len(command) - len(paths):]
+    return ' \\\n    '.join([f"RUN {shlex.join(options)}"] + [shlex.quote(p) for p in paths])
@@ -0,0 +1,118 @@
+""" Restrict the checkout of addon submodules to the addons that are actually needed
+
+The needed addons are the dependency closure of the addons to install. Because the addons of a sparse submodule
+are not on the disk, all addon manifests are read from the git objects of the submodule HEAD instead.
+"""
+from fnmatch import fnmatchcase
+from pathlib import Path, PurePosixPath
+from typing import Dict, List, NamedTuple, Iterable, Optional
+from .submodules import read_gitmodules, run_git
+from .manifest import parse_manifest
+from .addon_graph import AddonGraph
+from . import trace
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class GitAddon(NamedTuple):
+    name: str
+    submodule_dir: Path
+    # Path of the addon inside the submodule
+    path: str
+    depends: List[str]
+
+
+def _read_blobs(repo_dir: Path, objects: List[str]) -> List[Optional[str]]:
+    """ Returns the content of the given objects (e.g. 'HEAD:web_tree/__manifest__.py') with one git process """
+    if not objects:
+        return []
+    batch = ('\n'.join(objects) + '\n').encode()
+    out = run_git(repo_dir, 'cat-file', '--batch', input=batch, check=True, merge_stderr=False, text=False).stdout
+    contents: List[Optional[str]] = []
+    pos = 0
+    for _ in objects:
+        header_end = out.index(b'\n', pos)
+        header = out[pos:header_end].decode()
+        pos = header_end + 1
+        if header.endswith(' missing') or header.endswith(' ambiguous'):
+            contents.append(None)
+            continue
+        size = int(header.rsplit(' ', 1)[1])
+        contents.append(out[pos:pos + size].decode('utf-8', errors='replace'))
+        # Skip the content and the trailing newline
+        pos += size + 1
+    return contents
+
+
+def git_addons(submodule_dir: Path, pattern: str, manifest: str = '__manifest__.py') -> List[GitAddon]:
+    """ Returns the addons in the HEAD of a submodule that match a search pattern relative to the submodule
+
+    Only wildcards in the last part of the pattern are supported (e.g. '*' or 'addons/*').
+    """
+    pattern = PurePosixPath(pattern)
+    prefix = '' if str(pattern.parent) == '.' else f"{pattern.parent}/"
+    tree = run_git(submodule_dir, 'ls-tree', '-d', '--name-only', f"HEAD:{prefix}" if prefix else 'HEAD',
+                   check=True, merge_stderr=False).stdout
+    dirs = [prefix + d for d in tree.splitlines() if fnmatchcase(d, pattern.name) and not d.startswith('.')]
+    contents = _read_blobs(submodule_dir, [f"HEAD:{d}/{manifest}" for d in dirs])
+    addons = []
+    for d, content in zip(dirs, contents):
+        if content is None:
+            continue
+        name = PurePosixPath(d).name
+        try:
+            depends = list(parse_manifest(content, name=name, path=d).depends)
+        except ValueError as e:
+            logger.warning(str(e))
+            depends = []
+        addons.append(GitAddon(name=name, submodule_dir=submodule_dir, path=d, depends=depends))
+    return addons
+
+
+@trace.traced
+def submodule_addons(repo_dir: Path, search_paths: List[Path], manifest: str = '__manifest__.py') -> List[GitAddon]:
+    """ Returns the addons of all submodules of repo_dir that are matched by the (relative) addon search paths """
+    submodule_dirs = [PurePosixPath(s.path) for s in read_gitmodules(repo_dir)]
+    addons: List[GitAddon] = []
+    for search_path in search_paths:
+        search_path = PurePosixPath(search_path)
+        for submodule in submodule_dirs:
+            if submodule in search_path.parents:
+                submodule_dir = repo_dir / submodule
+                if not (submodule_dir / '.git').exists():
+                    logger.warning(f"Submodule '{submodule_dir}' is not initialized")
+                    break
+                addons += git_addons(submodule_dir, str(search_path.relative_to(submodule)), manifest=manifest)
+                break
+    return addons
+
+
+def plan_sparse_checkout(addons: List[GitAddon], addons_to_install: Iterable[str]) -> Dict[Path, List[str]]:
+    """ Returns the directories to check out for every submodule that contains addons
+
+    Submodules without any needed addon get an empty list (only the files at the submodule root are checked out).
+    """
+    closure = AddonGraph({a.name: a.depends for a in addons}).closure(addons_to_install)
+    plan: Dict[Path, List[str]] = {}
+    for addon in addons:
+        dirs = plan.setdefault(addon.submodule_dir, [])
+        if addon.name in closure:
+            dirs.append(addon.path)
+    return plan
+
+
+@trace.traced
+def apply_sparse_checkout(plan: Dict[Path, List[str]]):
+    """ Configure the (cone mode) sparse checkout of every submodule in the plan and update its working tree """
+    for submodule_dir, dirs in plan.items():
+        logger.info(f"Sparse checkout of {len(dirs)} addon directories in '{submodule_dir}'")
+        run_git(submodule_dir, 'sparse-checkout', 'set', '--cone', '--stdin', input='\n'.join(sorted(dirs)) + '\n',
+                check=True)
+
+
+def disable_sparse_checkout(submodule_dirs: Iterable[Path]):
+    """ Restore the full checkout of the given submodules """
+    for submodule_dir in submodule_dirs:
+        logger.info(f"Disable sparse checkout in '{submodule_dir}'")
+        run_git(submodule_dir, 'sparse-checkout', 'disable', check=True)
@@ -0,0 +1,276 @@
+import re
+import subprocess
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Union
+from . import trace
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Submodule updates are network and I/O bound
+SUBMODULE_JOBS = 8
+
+_SECTION_RE = re.compile(r'^\s*\[submodule\s+"(?P<name>[^"]+)"\s*]\s*$')
+_OPTION_RE = re.compile(r'^\s*(?P<key>[A-Za-z][A-Za-z0-9-]*)\s*=\s*(?P<value>.*?)\s*$')
+
+
+class Submodule(NamedTuple):
+    name: str
+    path: str
+    url: str
+    branch: Optional[str] = None
+
+
+class SubmoduleResult(NamedTuple):
+    submodule: Submodule
+    ok: bool
+    attempts: int
+    seconds: float
+    output: str
+
+
+def read_gitmodules(repo_dir: Path) -> List[Submodule]:
+    """ Returns the submodules of the .gitmodules file in repo_dir in file order
+
+    Only the subset of the git-config syntax used in .gitmodules files is supported: [submodule "name"] sections
+    with 'key = value' options. Comments and blank lines are ignored.
+    """
+    gitmodules = repo_dir / '.gitmodules'
+    if not gitmodules.is_file():
+        return []
+
+    sections: List[dict] = []
+    for line in gitmodules.read_text().splitlines():
+        if not line.strip() or line.lstrip().startswith(('#', ';')):
+            continue
+        section = _SECTION_RE.match(line)
+        if section:
+            sections.append({'name': section.group('name')})
+            continue
+        option = _OPTION_RE.match(line)
+        if option and sections:
+            sections[-1][option.group('key').lower()] = option.group('value').strip('"')
+
+    submodules = []
+    for s in sections:
+        if 'path' not in s or 'url' not in s:
+            logger.warning(f"Skip submodule '{s['name']}' without path or url in '{gitmodules}'")
+            continue
+        submodules.append(Submodule(name=s['name'], path=s['path'], url=s['url'], branch=s.get('branch')))
+    return submodules
+
+
+def run_git(repo_dir: Optional[Path], *args: str, config: Optional[List[str]] = None, timeout: Optional[float] = None,
+            input: Union[str, bytes, None] = None, check: bool = False, merge_stderr: bool = True,
+            text: bool = True) -> subprocess.CompletedProcess:
+    """ Run a git command in repo_dir and return the finished process. Every git call of the tools goes through here.
+
+    :param config: 'key=value' options for 'git -c'
+    :param input: Data for the stdin of git
+    :param check: Raise subprocess.CalledProcessError if git fails
+    :param merge_stderr: Capture stderr in stdout (for log messages). Else stdout only holds the output to parse.
+    :param text: str instead of bytes for input and output
+    """
+    cmd = ['git']
+    for c in config or []:
+        cmd += ['-c', c]
+    if repo_dir:
+        cmd += ['-C', str(repo_dir)]
+    trace.count('subprocess')
+    return subprocess.run(cmd + list(args), input=input, stdout=subprocess.PIPE,
+                          stderr=subprocess.STDOUT if merge_stderr else subprocess.PIPE,
+                          universal_newlines=text, timeout=timeout, check=check)
+
+
+def _run_job(submodule: Submodule, repo_dir: Optional[Path], args: List[str], config: Optional[List[str]],
+             retries: int, timeout: Optional[float]) -> SubmoduleResult:
+    """ Run a git command for a submodule and retry it on failure """
+    start = time.monotonic()
+    output = ''
+    attempt = 0
+    for attempt in range(1, retries + 2):
+        try:
+            with trace.span(f"git {args[0]}", submodule=submodule.path, attempt=attempt):
+                proc = run_git(repo_dir, *args, config=config, timeout=timeout)
+            output = proc.stdout
+            if proc.returncode == 0:
+                return SubmoduleResult(submodule, True, attempt, time.monotonic() - start, output)
+        except subprocess.TimeoutExpired:
+            output = f"Timeout after {timeout}s"
+        logger.warning(f"'git {args[0]}' for submodule '{submodule.path}' failed (attempt {attempt}): "
+                       f"{output.strip()}")
+    return SubmoduleResult(submodule, False, attempt, time.monotonic() - start, output)
+
+
+def recorded_commits(repo_dir: Path, submodules: List[Submodule]) -> Dict[str, str]:
+    """ Returns the commits recorded for the submodule paths (gitlinks) in the index of the superproject
+
+    'git submodule update' checks out exactly these commits. One 'git ls-files' call for all submodules.
+    """
+    proc = run_git(repo_dir, 'ls-files', '--stage', '-z', '--', *[s.path for s in submodules])
+    if proc.returncode != 0:
+        raise RuntimeError(f"git ls-files failed in '{repo_dir}':\n{proc.stdout}")
+    commits: Dict[str, str] = {}
+    for entry in proc.stdout.split('\0'):
+        if entry.startswith('160000 '):
+            info, path = entry.split('\t', 1)
+            commits[path] = info.split(' ')[1]
+    return commits
+
+
+def git_dir(work_dir: Path) -> Optional[Path]:
+    """ Returns the git directory of a working tree: either the .git folder or the target of a .git file """
+    dot_git = work_dir / '.git'
+    if dot_git.is_dir():
+        return dot_git
+    try:
+        content = dot_git.read_text().strip()
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    if not content.startswith('gitdir:'):
+        return None
+    return (work_dir / content[len('gitdir:'):].strip()).resolve()
+
+
+def head_commit(gitdir: Path) -> Optional[str]:
+    """ Returns the commit of HEAD by reading HEAD, the loose refs and packed-refs directly (no git process) """
+    try:
+        head = (gitdir / 'HEAD').read_text().strip()
+    except FileNotFoundError:
+        return None
+    if not head.startswith('ref:'):
+        return head
+    ref = head[len('ref:'):].strip()
+    try:
+        return (gitdir / ref).read_text().strip()
+    except FileNotFoundError:
+        pass
+    try:
+        for line in (gitdir / 'packed-refs').read_text().splitlines():
+            if line.endswith(f" {ref}") and not line.startswith(('#', '^')):
+                return line.split(' ', 1)[0]
+    except FileNotFoundError:
+        pass
+    return None
+
+
+def drifted_submodules(repo_dir: Path, submodules: List[Submodule]) -> List[Submodule]:
+    """ Returns the submodules whose checked out HEAD differs from the commit recorded in the superproject
+
+    Submodules that are not initialized or not checked out count as drifted.
+    """
+    recorded = recorded_commits(repo_dir, submodules)
+    drifted = []
+    for submodule in submodules:
+        gitdir = git_dir(repo_dir / submodule.path)
+        head = head_commit(gitdir) if gitdir else None
+        if head is None or head != recorded.get(submodule.path):
+            drifted.append(submodule)
+    return drifted
+
+
+def mirror_path(mirror_dir: Path, url: str) -> Path:
+    """ Returns the location of the bare mirror repository for a remote url inside mirror_dir
+
+    E.g. 'https://github.com/OCA/web.git' and 'git@github.com:OCA/web.git' both map to 'github.com/OCA/web.git'
+    """
+    location = re.sub(r'^[a-z+]+://', '', url)
+    location = re.sub(r'^[^@/]+@', '', location).replace(':', '/')
+    location = location.rstrip('/')
+    if not location.endswith('.git'):
+        location += '.git'
+    parts = [p for p in location.split('/') if p and p not in ('.', '..')]
+    return mirror_dir.joinpath(*parts)
+
+
+@trace.traced
+def update_mirrors(mirror_dir: Path, submodules: List[Submodule], jobs: int = SUBMODULE_JOBS, retries: int = 1,
+                   timeout: Optional[float] = None) -> List[SubmoduleResult]:
+    """ Create or fetch a bare mirror repository in mirror_dir for every (unique) submodule url """
+    unique = list(OrderedDict((s.url, s) for s in submodules).values())
+    if not unique:
+        return []
+
+    def mirror(submodule: Submodule) -> SubmoduleResult:
+        path = mirror_path(mirror_dir, submodule.url)
+        if path.is_dir():
+            return _run_job(submodule, path, ['fetch', '--prune', '--quiet'], None, retries, timeout)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return _run_job(submodule, None, ['clone', '--mirror', '--quiet', submodule.url, str(path)], None,
+                        retries, timeout)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(unique)))) as executor:
+        return list(executor.map(trace.inherit(mirror), unique))
+
+
+@trace.traced
+def update_submodules(repo_dir: Path, submodules: Optional[List[Submodule]] = None, jobs: int = SUBMODULE_JOBS,
+                      retries: int = 1, timeout: Optional[float] = None, update_args: Optional[List[str]] = None,
+                      mirror_dir: Optional[Path] = None, offline: bool = False,
+                      drift_only: bool = False) -> List[SubmoduleResult]:
+    """ Initialize and update the submodules of repo_dir concurrently
+
+    The submodules are registered in .git/config by a single 'git submodule init' first because concurrent
+    writes to the config of the superproject would fail on its lock file. Afterwards every submodule is updated
+    (cloned and checked out recursively) by its own 'git submodule update' process, at most 'jobs' at a time.
+
+    :param submodules: The submodules to update. Defaults to all submodules in .gitmodules.
+    :param retries: How often a failed update is retried
+    :param timeout: Timeout in seconds for a single update attempt
+    :param update_args: Additional arguments for 'git submodule update'
+    :param mirror_dir: Clone new submodules with '--reference --dissociate' from the mirrors in this directory
+                       (see update_mirrors()). Submodules without a mirror are cloned from their url.
+    :param offline: Clone and fetch from the mirrors only. The origin of new clones still points to the url.
+    :param drift_only: Only update the submodules whose HEAD differs from the recorded commit (see
+                       drifted_submodules()). Nested submodules of unchanged submodules are not checked.
+    :return: The results in the order of the submodules
+    """
+    if submodules is None:
+        submodules = read_gitmodules(repo_dir)
+    if not submodules:
+        return []
+    if offline and not mirror_dir:
+        raise ValueError("The offline mode needs a mirror_dir")
+    if drift_only:
+        submodules = drifted_submodules(repo_dir, submodules)
+        logger.info(f"Submodules to update: {[s.path for s in submodules]}")
+        if not submodules:
+            return []
+
+    init = run_git(repo_dir, 'submodule', 'init', '--', *[s.path for s in submodules])
+    if init.returncode != 0:
+        raise RuntimeError(f"git submodule init failed in '{repo_dir}':\n{init.stdout}")
+
+    def update(submodule: Submodule) -> SubmoduleResult:
+        args = ['submodule', 'update', '--checkout', '--recursive'] + list(update_args or [])
+        config = []
+        mirror = mirror_path(mirror_dir, submodule.url) if mirror_dir else None
+        if mirror and mirror.is_dir():
+            args += ['--reference', str(mirror), '--dissociate']
+            if offline:
+                # 'git submodule' does not pass -c options on to the clone, so the url itself must be overridden
+                config += ['protocol.file.allow=always', f'submodule.{submodule.name}.url={mirror}']
+        result = _run_job(submodule, repo_dir, args + ['--', submodule.path], config, retries, timeout)
+        if result.ok and offline and mirror and mirror.is_dir():
+            # Point the origin of the new clone back from the mirror to the real remote
+            run_git(repo_dir / submodule.path, 'remote', 'set-url', 'origin', submodule.url)
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(submodules)))) as executor:
+        return list(executor.map(trace.inherit(update), submodules))
+
+
+def format_results(results: List[SubmoduleResult], action: str = 'updated') -> str:
+    """ Returns a summary table of the submodule update results, slowest first """
+    lines = []
+    for r in sorted(results, key=lambda r: r.seconds, reverse=True):
+        status = 'ok' if r.ok else 'FAILED'
+        retried = f" ({r.attempts} attempts)" if r.attempts > 1 else ''
+        lines.append(f"{r.seconds:8.2f}s  {status:6}  {r.submodule.path}{retried}")
+    failed = sum(1 for r in results if not r.ok)
+    lines.append(f"{len(results)} submodules {action} in {sum(r.seconds for r in results):.2f}s "
+                 f"(cumulative), {failed} failed")
+    return '\n'.join(lines)
@@ -1,13 +1,25 @@
-import os
 import copy
 from pathlib import Path
-from invoke import task
-from typing import Optional
+from invoke import task, Exit
+from collections import OrderedDict
+from typing import Optional, Tuple, List, Dict, TYPE_CHECKING
 from tools.globals import ALLOWED_ENVIRONMENTS
-from tools.env_settings import FsonlineEnv
-from tools.helper import symlink_rel, log_time
+from tools.tasks.globals_invoke import fsonline_env_settings
+from tools.submodules import (
+    read_gitmodules,
+    update_mirrors,
+    update_submodules,
+    format_results,
+    SUBMODULE_JOBS,
+)
+from tools.sparse import submodule_addons, plan_sparse_checkout, apply_sparse_checkout, disable_sparse_checkout
+from tools.helper import plan_symlinks, plan_changes, execute_plan, log_time
+from tools import trace
 import logging
 
+if TYPE_CHECKING:
+    from tools.env_settings import FsonlineEnv
+
 logger = logging.getLogger(__name__)
 
 ENV_TYPE = Optional[ALLOWED_ENVIRONMENTS]
@@ -19,76 +31,224 @@ ENV_TYPE = Optional[ALLOWED_ENVIRONMENTS]
 
 
 @task
-def init_submodules(c, in_path=None):
-    """ Initialize all submodules recursively """
-    e: FsonlineEnv = c['fsonline_env_settings']
-    in_path: Path = in_path or e.repo_dir
-    c.run(f"git -C {in_path} submodule update --init --checkout --recursive")
+@log_time
+def mirror_submodules(c, in_path=None, jobs=SUBMODULE_JOBS, retries=1, timeout=None):
+    """ Create or update a local bare mirror for every submodule url in [git_mirror_dir]
+
+        The mirrors are shared by all repositories of the host and used by init_submodules as object reference.
+    """
+    e: FsonlineEnv = fsonline_env_settings(c)
+    in_path: Path = Path(in_path) if in_path else e.repo_dir
+    results = update_mirrors(e.git_mirror_dir, read_gitmodules(in_path), jobs=int(jobs), retries=int(retries),
+                             timeout=float(timeout) if timeout else None)
+    logger.info(f"Mirrors in '{e.git_mirror_dir}':\n{format_results(results, action='mirrored')}")
+    failed = [r.submodule.url for r in results if not r.ok]
+    if failed:
+        raise Exit(f"Mirror failed for: {', '.join(failed)}", code=1)
+    return results
 
 
 @task
-def symlink_odoo(c, mode=0o770, clean=True, dry=False):
-    """ Symlink odoo and addon sources for development """
-    # TODO: a mode to only add missing symlink eg. update=True (which can not be mixed with clean)
-    e: FsonlineEnv = c['fsonline_env_settings']
+@log_time
+def init_submodules(c, in_path=None, jobs=SUBMODULE_JOBS, retries=1, timeout=None, offline=False, all_=False):
+    """ Initialize all submodules recursively
 
-    logger.debug(f"Create dev_dir at '{e.dev_dir}'")
-    if not dry:
-        e.dev_dir.mkdir(mode=mode, exist_ok=True)
+        Only submodules whose checked out commit differs from the commit recorded in the repository are updated.
+        Submodules are cloned with the mirrors in [git_mirror_dir] as reference if they exist.
 
-    if not dry and clean and e.dev_fson_tgt_dir.exists():
-        if e.repo_dir not in e.dev_fson_tgt_dir.parents:
-            raise ValueError(f"dev_odoo_tgt_dir {e.dev_fson_tgt_dir} outside repo_dir {e.repo_dir}")
-        logger.warning(f"Clean dev_fson_tgt_dir at '{e.dev_fson_tgt_dir}'")
-        e.dev_fson_tgt_dir.rmdir()
+        --all:     Update all submodules, not only the drifted ones
 
-    logger.debug(f"Create dev_odoo_tgt_dir at '{e.dev_fson_tgt_dir}'")
-    if not dry:
-        e.dev_fson_tgt_dir.mkdir(mode=mode, exist_ok=True)
+        --jobs:    Number of submodules to update concurrently
+        --retries: How often the update of a failed submodule is retried
+        --timeout: Timeout in seconds for a single submodule update
+        --offline: Clone and fetch from the mirrors in [git_mirror_dir] only
+    """
+    e: FsonlineEnv = fsonline_env_settings(c)
+    in_path: Path = Path(in_path) if in_path else e.repo_dir
+    results = update_submodules(in_path, jobs=int(jobs), retries=int(retries),
+                                timeout=float(timeout) if timeout else None,
+                                mirror_dir=e.git_mirror_dir, offline=offline, drift_only=not all_)
+    logger.info(f"Submodules of '{in_path}':\n{format_results(results)}")
+    failed = [r.submodule.path for r in results if not r.ok]
+    if failed:
+        raise Exit(f"Update failed for submodules: {', '.join(failed)}", code=1)
+    return results
 
-    logger.info(f"Symlink from core_odoo_src '{e.core_odoo_src}' to dev_odoo_tgt_dir '{e.dev_fson_tgt_dir}'")
+
+@task
+@log_time
+def sparse_submodules(c, disable=False, dry=False):
+    """ Check out only the addons of the submodules that are needed by the addons to install
+
+        The needed addons are the dependency closure of [core_addons_to_install] and [inst_addons_to_install].
+        Only submodules that contain addons of [core_addon_src] or [inst_addon_src] are changed.
+
+        --disable: Restore the full checkout of these submodules
+        --dry:     Print the addon directories per submodule instead of changing the checkout
+    """
+    e: FsonlineEnv = fsonline_env_settings(c)
+    manifest = e.cov.odoo_manifest_name
+    addons = submodule_addons(e.core_dir, e.core_addon_src, manifest=manifest)
+    if e.inst_dir and e.inst_addon_src:
+        addons += submodule_addons(e.inst_dir, e.inst_addon_src, manifest=manifest)
+
+    if disable:
+        submodule_dirs = list(dict.fromkeys(a.submodule_dir for a in addons))
+        if not dry:
+            disable_sparse_checkout(submodule_dirs)
+        return submodule_dirs
+
+    addons_to_install = e.addons_to_install()
+    if not addons_to_install:
+        raise Exit("No addons to install configured (CORE_ADDONS_TO_INSTALL, INST_ADDONS_TO_INSTALL)", code=1)
+
+    plan = plan_sparse_checkout(addons, addons_to_install)
+    if dry:
+        for submodule_dir, dirs in plan.items():
+            print(f"{submodule_dir}: {' '.join(sorted(dirs))}")
+        return plan
+
+    apply_sparse_checkout(plan)
+    return plan
+
+
+def fson_links(e: 'FsonlineEnv', prune=False, tgt_dir: Optional[Path] = None) -> Tuple[List[Path], Dict[Path, Path]]:
+    """ Returns the directories and the symlinks (target: source) of the dev_fson_tgt_dir tree
+
+    The directories are ordered parent first. The symlinks are ordered like the original linking order.
+
+    :param prune: Only include the addons that are needed by the addons to install (FsonlineEnv.needed_addons())
+    :param tgt_dir: Root of the tree instead of dev_fson_tgt_dir
+    """
+    fson_tgt_dir = tgt_dir or e.dev_fson_tgt_dir
+    odoo_tgt_dir = fson_tgt_dir / 'odoo'
+    all_addons_tgt_dir = odoo_tgt_dir / 'addons'
+    links: Dict[Path, Path] = OrderedDict()
+    manifest = e.cov.odoo_manifest_name
+    needed = e.needed_addons() if prune else None
+
+    def wanted(addon_dir: Path) -> bool:
+        # Files and folders that are no addons (e.g. odoo/addons/__init__.py) are always linked
+        return needed is None or addon_dir.name in needed or not (addon_dir / manifest).is_file()
 
     # Link OCA/OCB/* without  OCA/OCB/odoo and OCA/OCB/addons
-    fson_tgt_dir = e.dev_fson_tgt_dir
-    for f in e.core_odoo_dir.iterdir():
+    for f in sorted(e.core_odoo_dir.iterdir()):
         # Exclude the two addon directories in the and the odoo folder
         if f.is_dir() and f.name in ['addons', 'odoo']:
             continue
-        tgt = fson_tgt_dir / f.name
-        symlink_rel(source=f, target=tgt, dry=dry)
+        links[fson_tgt_dir / f.name] = f
 
     # Link OCA/OCB/odoo/* without OCA/OCB/odoo/addons
-    odoo_tgt_dir = e.dev_fson_tgt_dir / 'odoo'
-    if not dry:
-        odoo_tgt_dir.mkdir(mode=mode, exist_ok=True)
-    for f in (e.core_odoo_dir / 'odoo').iterdir():
+    for f in sorted((e.core_odoo_dir / 'odoo').iterdir()):
         if f.is_dir() and f.name == 'addons':
             continue
-        tgt = odoo_tgt_dir / f.name
-        symlink_rel(source=f, target=tgt, dry=dry)
-
-    # Create the target dir for all addons fsonline/dev/fsonline/odoo/addons
-    all_addons_tgt_dir = odoo_tgt_dir / 'addons'
-    if not dry:
-        all_addons_tgt_dir.mkdir(mode=mode, exist_ok=True)
+        links[odoo_tgt_dir / f.name] = f
 
     # Link OCA/OCB/odoo/addons
-    for f in (e.core_odoo_dir / 'odoo' / 'addons').iterdir():
-        symlink_rel(source=f, target=(all_addons_tgt_dir / f.name), dry=dry)
+    for f in sorted((e.core_odoo_dir / 'odoo' / 'addons').iterdir()):
+        if wanted(f):
+            links[all_addons_tgt_dir / f.name] = f
 
     # Link OCA/OCB/addons
-    for f in (e.core_odoo_dir / 'addons').iterdir():
-        symlink_rel(source=f, target=(all_addons_tgt_dir / f.name), dry=dry)
+    for f in sorted((e.core_odoo_dir / 'addons').iterdir()):
+        if wanted(f):
+            links[all_addons_tgt_dir / f.name] = f
 
     # Link all third party addons (own addons, OCA addons, smile addons, ...)
-    third_party_addons = copy.copy(e.core_addon_dirs)
+    third_party_addons = copy.copy(e.core_addon_dirs or [])
     if e.inst_addon_dirs:
         third_party_addons += e.inst_addon_dirs
     for addon_dir in third_party_addons:
-        symlink_rel(source=addon_dir, target=(all_addons_tgt_dir / addon_dir.name), dry=dry)
+        if not wanted(addon_dir):
+            continue
+        tgt = all_addons_tgt_dir / addon_dir.name
+        if tgt in links:
+            raise ValueError(f"Addon '{addon_dir.name}' at '{addon_dir}' is already provided by '{links[tgt]}'")
+        links[tgt] = addon_dir
+
+    return [fson_tgt_dir, odoo_tgt_dir, all_addons_tgt_dir], links
+
+
+@task
+@log_time
+def symlink_odoo(c, mode=0o770, clean=True, dry=False, update=False, prune=False):
+    """ Symlink odoo and addon sources for development
+
+        --update: Reconcile existing symlinks instead of creating them from scratch. Only missing, wrong or
+                  obsolete symlinks are created, retargeted or removed. 'clean' is ignored in this mode.
+        --dry:    Print the planned file system operations (one per line) instead of executing them
+        --prune:  Only link the addons in the dependency closure of [core_addons_to_install],
+                  [inst_addons_to_install] and the odoo server wide addons
+    """
+    e: FsonlineEnv = fsonline_env_settings(c)
+
+    if e.repo_dir not in e.dev_fson_tgt_dir.parents:
+        raise ValueError(f"dev_odoo_tgt_dir {e.dev_fson_tgt_dir} outside repo_dir {e.repo_dir}")
+
+    logger.info(f"Symlink from core_odoo_src '{e.core_odoo_src}' to dev_odoo_tgt_dir '{e.dev_fson_tgt_dir}'")
+    with trace.span('fson_links', prune=prune):
+        dirs, links = fson_links(e, prune=prune)
+    # dev_dir is only created: it holds other files and links than the odoo tree
+    plan = plan_symlinks(dirs, links, mode=mode, clean=clean and not update, update=update, parents=[e.dev_dir])
+
+    if dry:
+        for op in plan:
+            print(op)
+        return plan
+
+    execute_plan(plan)
+    if update:
+        logger.info(f"Symlinks in '{e.dev_fson_tgt_dir}': " + ", ".join(
+            f"{len(changed)} {action}" for action, changed in plan_changes(plan).items()))
+    else:
+        logger.info(f"Symlinks in '{e.dev_fson_tgt_dir}': {sum(1 for op in plan if op.op == 'symlink')} created")
+    return plan
+
+
+@task(name='trace')
+def trace_(c, file=''):
+    """ Trace the tasks that follow in the same invoke call, e.g. 'invoke dev.trace dev.init'
+
+        The nested spans and counters are written as Chrome trace-event JSON (chrome://tracing or
+        https://ui.perfetto.dev) and a summary table is logged when invoke exits.
+        Tracing can also be enabled with the environment variable FSONLINE_TRACE=<trace file>.
+
+        --file: The trace file. Defaults to [repo_dir]/.cache/trace.json
+    """
+    from tools.env_settings import conventions
+    trace.enable(Path(file) if file else conventions().cache_dir / 'trace.json')
+
+
+@task
+@log_time
+def benchmark(c, sizes='100,1000,5000,20000', repeat=3, output='', compare='', threshold=0.1):
+    """ Benchmark addon discovery, env files, settings, symlinking and the copier post processing
+
+        Every size is the number of addons of a generated repository in [repo_dir]/.cache.
+
+        --sizes:     Comma separated numbers of addons
+        --output:    The result file. Defaults to [repo_dir]/.cache/benchmarks/<date>.json
+        --compare:   A former result file: print the change of every benchmark and mark the regressions
+        --threshold: Slowdown that counts as regression (0.1 = 10%)
+    """
+    import json
+    import time
+    from tools.benchmark import run_benchmarks, save_results, compare_results
+    from tools.env_settings import conventions
+
+    cache_dir = conventions().cache_dir
+    cache_dir.mkdir(exist_ok=True)
+    results = run_benchmarks([int(s) for s in sizes.split(',')], repeat=int(repeat), work_dir=cache_dir)
+    output = Path(output) if output else cache_dir / 'benchmarks' / f"{time.strftime('%Y%m%d-%H%M%S')}.json"
+    save_results(results, output)
+    logger.info(f"Benchmark results written to '{output}'")
+    if compare:
+        print('\n'.join(compare_results(json.loads(Path(compare).read_text()), results, float(threshold))))
+    return results
 
 
 @task(pre=[init_submodules, symlink_odoo], default=True)
+@log_time
 def init(c, env=''):
     """ Initialize the development environment
             - initialize submodules recursively
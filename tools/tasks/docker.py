@@ -0,0 +1,190 @@
+import shutil
+from pathlib import Path
+from typing import Dict, TYPE_CHECKING
+from invoke import task, Exit
+from tools.tasks.globals_invoke import fsonline_env_settings
+from tools.helper import log_time
+from tools.precompile import PRECOMPILE_EXCLUDE
+import logging
+
+if TYPE_CHECKING:
+    from tools.env_settings import FsonlineEnv
+
+logger = logging.getLogger(__name__)
+
+
+@task
+@log_time
+def materialise(c, method='auto', clean=False, prune=False):
+    """ Copy odoo and the addons as real files to [build_fson_tgt_dir] for docker (no symlinks)
+
+        The tree has the same layout as the one of dev.symlink-odoo. Only files that changed since the last run
+        are copied again, files that are gone are removed.
+
+        --method: 'auto' (reflink, else hardlink, else copy), 'reflink', 'hardlink' or 'copy'.
+                  ATTENTION: Hardlinked files are the source files: never edit files in the build tree!
+        --clean:  Remove the build tree first
+        --prune:  Only copy the addons in the dependency closure of the addons to install
+    """
+    # Imported here to keep 'invoke --list' fast
+    from tools.content_hash import HashStore
+    from tools.materialise import Materialiser, tree_files
+    from tools.tasks.dev import fson_links
+
+    e: FsonlineEnv = fsonline_env_settings(c)
+    tgt_dir: Path = e.build_fson_tgt_dir
+    if e.repo_dir not in tgt_dir.parents:
+        raise ValueError(f"build_fson_tgt_dir {tgt_dir} outside repo_dir {e.repo_dir}")
+
+    materialiser = Materialiser(tgt_dir, e.cov.materialise_manifest_file, method=method,
+                                hashes=HashStore(e.cov.content_hash_cache_file))
+    if clean and tgt_dir.exists():
+        shutil.rmtree(tgt_dir)
+        e.cov.materialise_manifest_file.unlink(missing_ok=True)
+
+    _, links = fson_links(e, prune=prune, tgt_dir=tgt_dir)
+    result = materialiser.materialise(tree_files(links))
+    logger.info(f"Materialised '{tgt_dir}': " + ", ".join(
+        [f"{n} {method}" for method, n in sorted(result.created.items())] +
+        [f"{result.skipped} unchanged", f"{result.removed} removed"]))
+    return result
+
+
+@task
+@log_time
+def build(c, tag='fsonline-odoo', dockerfile='', prune=False, output='', layers='submodule',
+          precompile='checked-hash', precompile_exclude=PRECOMPILE_EXCLUDE):
+    """ Build the docker image with a minimal build context that is streamed to 'docker build -'
+
+        The context holds only the Dockerfile, odoo and the resolved addon directories (no symlinks, no .git).
+
+        --dockerfile: Base Dockerfile. Defaults to tools/docker/Dockerfile. The COPYs of the odoo tree are appended.
+        --prune:      Only add the addons in the dependency closure of the addons to install
+        --output:     Write the context as tar file instead of building the image ('-' for stdout)
+        --layers:     Copy the odoo tree in layers, the least volatile first, ordered by
+                      'submodule': odoo, odoo addons, the addons of every submodule, the own addons
+                      'churn':     like 'submodule' but the submodules by their number of commits in the last year
+                      'single':    one layer for everything
+        --precompile: Byte-compile every layer in the image after its COPY with this pyc invalidation mode:
+                      'timestamp', 'checked-hash' (reproducible) or 'unchecked-hash' (reproducible, no checks at
+                      runtime). 'none' to skip it. A file that does not compile fails the build.
+        --precompile-exclude: Regular expression of the paths not to compile. Defaults to the files below static/.
+    """
+    # Imported here to keep 'invoke --list' fast
+    import subprocess
+    import sys
+    from tools.build_context import CONTEXT_SRC_DIR, IMAGE_SRC_DIR, context_dockerfile, write_context
+    from tools.content_hash import VCS_METADATA
+    from tools.layers import layer_groups, order_groups, layer_dir, layer_files, layered_dockerfile
+    from tools.materialise import tree_files
+    from tools.precompile import precompile_instruction
+    from tools.tasks.dev import fson_links
+
+    e: FsonlineEnv = fsonline_env_settings(c)
+    base = Path(dockerfile) if dockerfile else e.cov.script_folder / 'docker' / 'Dockerfile'
+    tgt_dir = Path(CONTEXT_SRC_DIR)
+    precompile = '' if precompile == 'none' else precompile
+
+    def compile_step(paths) -> str:
+        return (precompile_instruction(paths, invalidation_mode=precompile, exclude=precompile_exclude or None)
+                if precompile else '')
+
+    _, links = fson_links(e, prune=prune, tgt_dir=tgt_dir)
+    # No repository metadata in the image (e.g. the .git and .github of OCB). tree_files() skips it in the sources.
+    links = {target: source for target, source in links.items() if target.name not in VCS_METADATA}
+    if layers == 'single':
+        files = tree_files(links)
+        content = context_dockerfile(base.read_text(), after=compile_step([IMAGE_SRC_DIR]))
+    else:
+        repo_dirs = [e.core_dir] + ([e.inst_dir] if e.inst_dir else [])
+        groups = order_groups(layer_groups(links, tgt_dir, e.core_odoo_dir, repo_dirs), order=layers)
+        files = layer_files(groups, tgt_dir, tree_files)
+        # Compile only the paths of the layer, so an unchanged layer keeps its cached compile layer
+        compile_steps = [compile_step([f"{IMAGE_SRC_DIR}/{t.relative_to(tgt_dir).as_posix()}" for t in g.links])
+                         for g in groups]
+        content = layered_dockerfile(base.read_text(), [layer_dir(i, g) for i, g in enumerate(groups)],
+                                     IMAGE_SRC_DIR, after=compile_steps)
+
+    if output == '-':
+        return write_context(sys.stdout.buffer, content, files)
+    if output:
+        with open(output, 'wb') as f:
+            return write_context(f, content, files)
+
+    logger.info(f"Build '{tag}' with {len(files)} files")
+    proc = subprocess.Popen(['docker', 'build', '-t', tag, '-'], stdin=subprocess.PIPE)
+    try:
+        written = write_context(proc.stdin, content, files)
+    except BrokenPipeError:
+        written = 0
+    finally:
+        proc.stdin.close()
+    if proc.wait() != 0:
+        raise Exit(f"docker build failed with exit code {proc.returncode}", code=proc.returncode)
+    return written
+
+
+@task
+@log_time
+def precompile(c, python='python3', invalidation_mode='checked-hash', workers=0, exclude=PRECOMPILE_EXCLUDE):
+    """ Byte-compile the materialised odoo tree in [build_fson_tgt_dir] (see docker.materialise)
+
+        --python:            The interpreter that runs odoo, pyc files only work with the same python version
+        --invalidation-mode: 'timestamp', 'checked-hash' or 'unchecked-hash' (see tools/precompile.py)
+        --workers:           Number of compile processes, 0 for one per cpu
+        --exclude:           Regular expression of the paths not to compile. Defaults to the files below static/.
+    """
+    # Imported here to keep 'invoke --list' fast
+    from tools.precompile import precompile as compile_tree
+
+    e: FsonlineEnv = fsonline_env_settings(c)
+    if not e.build_fson_tgt_dir.is_dir():
+        raise Exit(f"'{e.build_fson_tgt_dir}' does not exist, run docker.materialise first", code=1)
+    if not compile_tree([str(e.build_fson_tgt_dir)], python, int(workers), invalidation_mode or None, exclude or None):
+        raise Exit("Some files could not be compiled", code=1)
+
+
+@task
+@log_time
+def lock(c, prune=False, check=False):
+    """ Write the content hash and the (submodule) commit of odoo and of every addon to [lock_file]
+
+        The hashes only depend on the content of the files, so build, image and deploy steps can skip their work
+        if the hashes did not change since the last run. Prints the odoo tree and addons that changed.
+
+        --prune: Only lock the addons in the dependency closure of the addons to install
+        --check: Do not write the lock file. Exit with code 1 if anything changed.
+    """
+    # Imported here to keep 'invoke --list' fast
+    from tools.content_hash import (
+        HashStore,
+        changed_trees,
+        lock_entries,
+        read_lock_file,
+        write_lock_file,
+        ODOO_TREE,
+    )
+
+    e: FsonlineEnv = fsonline_env_settings(c)
+    odoo_addon_dirs = e.odoo_addon_dirs()
+    addon_dirs = odoo_addon_dirs + (e.core_addon_dirs or []) + (e.inst_addon_dirs or [])
+    if prune:
+        needed = e.needed_addons()
+        addon_dirs = [d for d in addon_dirs if d.name in needed]
+
+    # The odoo tree without its addons
+    trees: Dict[str, Path] = {ODOO_TREE: e.core_odoo_dir, **{d.name: d for d in addon_dirs}}
+    exclude = {ODOO_TREE: {d.relative_to(e.core_odoo_dir).as_posix() for d in odoo_addon_dirs}}
+    hashes = HashStore(e.cov.content_hash_cache_file)
+    entries = lock_entries(trees, hashes.tree_hashes(trees, exclude=exclude))
+    hashes.save()
+
+    changed = sorted(changed_trees(read_lock_file(e.cov.lock_file), entries))
+    if changed:
+        print('\n'.join(changed))
+    if check:
+        if changed:
+            raise Exit(f"{len(changed)} changed since the last lock", code=1)
+        return entries
+    write_lock_file(e.cov.lock_file, entries)
+    return entries
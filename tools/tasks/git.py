@@ -1,6 +1,72 @@
-from invoke import task
+import subprocess
+from pathlib import Path
+from typing import List, TYPE_CHECKING
+from invoke import task, Exit
+from tools.tasks.globals_invoke import fsonline_env_settings
+from tools.impact import changed_files, owning_addons, is_inside
+from tools.helper import log_time
+import logging
+
+if TYPE_CHECKING:
+    from tools.env_settings import FsonlineEnv
+
+logger = logging.getLogger(__name__)
 
 
 @task
 def reset(git_repo_dir, branch_or_tag=None):
     """ Will completely reset the git repository and clean all unknown files """
+
+
+@task
+@log_time
+def changed_addons(c, rev_range='', core_range='', inst_range='', needed_only=False, separator=','):
+    """ Print the addons changed in a revision range and all addons that depend on them
+
+        The result is in install order and can be used for 'odoo -u'. Changes to odoo itself outside of any addon
+        count as a change of 'base'. Changed submodules are followed recursively.
+
+        rev_range:     A git revision range like 'v1.0..v1.1' or a single revision (same as '<rev>..HEAD') for the
+                       core and the instance repository
+        --core-range:  The revision range of the core repository. Defaults to rev_range.
+        --inst-range:  The revision range of the instance repository. Defaults to rev_range.
+                       A repository without a range is skipped.
+        --needed-only: Only print addons that are needed by the addons to install
+        --separator:   Separator for the printed addon names
+    """
+    e: FsonlineEnv = fsonline_env_settings(c)
+    ranges = [(e.core_dir, core_range or rev_range)]
+    if e.inst_dir and e.inst_dir != e.core_dir:
+        ranges.append((e.inst_dir, inst_range or rev_range))
+    if not any(r for _, r in ranges):
+        raise Exit("No revision range: pass rev_range, --core-range or --inst-range", code=1)
+
+    files: List[Path] = []
+    for repo_dir, repo_range in ranges:
+        if not repo_range:
+            logger.info(f"Skip '{repo_dir}' without a revision range")
+            continue
+        try:
+            files += changed_files(repo_dir, repo_range)
+        except subprocess.CalledProcessError as err:
+            raise Exit(f"Revision range '{repo_range}' does not resolve in '{repo_dir}': {(err.stderr or '').strip()}"
+                       f"\nUse --core-range and --inst-range for the ranges of the single repositories.", code=1)
+    # The core repository can be a submodule of the instance repository
+    files = list(dict.fromkeys(files))
+
+    graph = e.addon_graph()
+    changed = owning_addons(files, e.addon_dirs())
+    addon_files = set(f for files_of_addon in changed.values() for f in files_of_addon)
+    core_files = [f for f in files if f not in addon_files and is_inside(f, e.core_odoo_dir)]
+    if core_files:
+        logger.warning(f"{len(core_files)} files of odoo itself changed: all addons are affected")
+        changed.setdefault('base', []).extend(core_files)
+    for name, addon_files in sorted(changed.items()):
+        logger.info(f"Addon '{name}': {len(addon_files)} changed files")
+
+    impacted = graph.reverse_closure(changed)
+    if needed_only:
+        impacted &= e.needed_addons(graph)
+    order = graph.topological_order(impacted)
+    print(separator.join(order))
+    return order
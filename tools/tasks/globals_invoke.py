@@ -1,9 +1,25 @@
-from typing import Literal, TypedDict, Optional
-from tools.env_settings import FsonlineEnv
+from typing import Literal, TypedDict, Optional, TYPE_CHECKING
 from tools.globals import ALLOWED_ENVIRONMENTS
 
+if TYPE_CHECKING:
+    from tools.env_settings import FsonlineEnv
+
 
 INVOKE_CONTEXT_TYPE = TypedDict('INVOKE_CONTEXT_TYPE',
                                 {'env': ALLOWED_ENVIRONMENTS,
-                                 'fso_settings': FsonlineEnv},
+                                 'fso_settings': 'FsonlineEnv'},
                                 total=False)
+
+
+def fsonline_env_settings(c) -> 'FsonlineEnv':
+    """ Returns the fsonline settings of the invoke context and resolves them on first access
+
+    The settings (and pydantic) are only loaded when a task actually needs them - not when tasks.py is loaded
+    for 'invoke --list' or the shell completion.
+    """
+    settings = c.config.get('fsonline_env_settings')
+    if settings is None:
+        from tools.env_settings import cached_fsonline_env
+        settings = cached_fsonline_env()
+        c.config['fsonline_env_settings'] = settings
+    return settings
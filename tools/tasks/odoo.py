@@ -1,16 +1,46 @@
+from typing import TYPE_CHECKING
 from invoke import task
-from tools.env_settings import FsonlineEnv
-from tools.template_post_processing import CopierPostProcessing
+from tools.tasks.globals_invoke import fsonline_env_settings
+from tools.helper import log_time
+from tools import trace
 import logging
 
+if TYPE_CHECKING:
+    from tools.env_settings import FsonlineEnv
+
 logger = logging.getLogger(__name__)
 
 
+def _run(c, command: str, **kwargs):
+    """ c.run() that counts the subprocess in the trace """
+    trace.count('subprocess')
+    return c.run(command, **kwargs)
+
+
+@task(iterable=['addon'])
+@log_time
+def install_order(c, addon=None):
+    """ Print the dependency closure of the addons to install in install order
+
+        --addon: Addon(s) to install. Defaults to [core_addons_to_install] and [inst_addons_to_install].
+    """
+    e: FsonlineEnv = fsonline_env_settings(c)
+    roots = addon or e.addons_to_install()
+    graph = e.addon_graph()
+    missing = graph.missing(graph.closure(roots)) | {name for name in roots if name not in graph}
+    if missing:
+        logger.warning(f"Addons not found: {', '.join(sorted(missing))}")
+    order = graph.install_order(roots)
+    print('\n'.join(order))
+    return order
+
+
 @task
+@log_time
 def create_addon(c, name, core=False, minimal=False):
     """ Create a new Odoo addon """
 
-    e: FsonlineEnv = c['fsonline_env_settings']
+    e: FsonlineEnv = fsonline_env_settings(c)
     if not e.inst_dir:
         core = True
 
@@ -41,14 +71,16 @@ def create_addon(c, name, core=False, minimal=False):
             " -d unittest=False"
 
     shell_command = f"copier \"{template_src}\" \"{target_dir}\" {args}"
-    c.run(shell_command, pty=True)
+    with trace.span('copier', template=template_src.name):
+        _run(c, shell_command, pty=True)
 
 
 @task
+@log_time
 def create_model(c, addon, core=False):
     """ Create a new Odoo model """
 
-    e: FsonlineEnv = c['fsonline_env_settings']
+    e: FsonlineEnv = fsonline_env_settings(c)
     if not e.inst_dir:
         core = True
 
@@ -70,10 +102,15 @@ def create_model(c, addon, core=False):
     # delete the whole addon, if an exception occurs
     shell_command = f"copier \"{template_src}\" \"{tmp_target_dir}\" {args}"
 
-    if c.run(shell_command, pty=True):
+    with trace.span('copier', template=template_src.name):
+        copied = _run(c, shell_command, pty=True)
+    if copied:
         try:
-            c.run(f"cp -r -n \"{tmp_target_dir}/.\" \"{target_dir}\"")
+            _run(c, f"cp -r -n \"{tmp_target_dir}/.\" \"{target_dir}\"")
+            # Imported here because the module configures the logging on import
+            from tools.template_post_processing import CopierPostProcessing
             processor = CopierPostProcessing(target_dir)
-            processor.process()
+            with trace.span('copier_post_processing'):
+                processor.process()
         finally:
-            c.run(f"rm -r \"{tmp_target_dir}\"")
+            _run(c, f"rm -r \"{tmp_target_dir}\"")
@@ -0,0 +1,189 @@
+""" Hierarchical timing of the tooling: nested spans, counters, Chrome trace export and a summary table
+
+Tracing is off by default and then costs a function call per span. Enable it with the environment variable
+FSONLINE_TRACE=<trace file> (or enable() in code, e.g. by the 'dev.trace' task). When the process exits the
+spans are written as Chrome trace-event JSON (open it in chrome://tracing or https://ui.perfetto.dev) and a
+summary table is logged.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+TRACE_ENV_VAR = 'FSONLINE_TRACE'
+
+
+class Span(NamedTuple):
+    name: str
+    # Names of the enclosing spans of the same thread, outermost first
+    parents: Tuple[str, ...]
+    start: float
+    seconds: float
+    thread_id: int
+    args: Dict[str, object]
+
+
+class Tracer:
+    """ Collects the spans and counters of all threads """
+
+    def __init__(self, trace_file: Optional[Path] = None):
+        self.trace_file = trace_file
+        self.spans: List[Span] = []
+        self.counters: Counter = Counter()
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self) -> List[str]:
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @contextmanager
+    def span(self, name: str, **args):
+        stack = self._stack()
+        parents = tuple(stack)
+        stack.append(name)
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            seconds = time.perf_counter() - start
+            stack.pop()
+            with self._lock:
+                self.spans.append(Span(name, parents, start, seconds, threading.get_ident(), args))
+
+    def inherit(self, func):
+        stack = tuple(self._stack())
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            previous = self._stack()
+            self._local.stack = list(stack)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._local.stack = previous
+
+        return wrapper
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] += n
+
+    def chrome_trace(self) -> dict:
+        """ Returns the spans as Chrome trace-event JSON ('complete' events) and the counters as one counter event """
+        pid = os.getpid()
+        events = [{'name': s.name, 'cat': s.parents[0] if s.parents else s.name, 'ph': 'X', 'pid': pid,
+                   'tid': s.thread_id, 'ts': round((s.start - self.started) * 1e6, 1),
+                   'dur': round(s.seconds * 1e6, 1), 'args': {k: str(v) for k, v in s.args.items()}}
+                  for s in sorted(self.spans, key=lambda s: s.start)]
+        if self.counters:
+            events.append({'name': 'counters', 'ph': 'C', 'pid': pid, 'tid': 0,
+                           'ts': round((time.perf_counter() - self.started) * 1e6, 1), 'args': dict(self.counters)})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save(self, trace_file: Path):
+        trace_file.parent.mkdir(parents=True, exist_ok=True)
+        trace_file.write_text(json.dumps(self.chrome_trace()))
+
+    def summary(self) -> str:
+        """ Returns a table of the spans aggregated by their nesting path (in the order of their first start)
+        followed by the counters
+        """
+        totals: Dict[Tuple[str, ...], List[float]] = {}
+        for s in sorted(self.spans, key=lambda s: s.start):
+            total = totals.setdefault(s.parents + (s.name,), [0, 0.0])
+            total[0] += 1
+            total[1] += s.seconds
+        # Children start after their parent, so sort the paths to get every child right after its parent
+        first = {path: i for i, path in enumerate(totals)}
+        order = sorted(totals, key=lambda path: [first.get(path[:i + 1], 0) for i in range(len(path))])
+
+        lines = [f"{'seconds':>9}  {'calls':>6}  span"]
+        for path in order:
+            calls, seconds = totals[path]
+            lines.append(f"{seconds:8.3f}s  {calls:6d}  {'  ' * (len(path) - 1)}{path[-1]}")
+        for name, n in sorted(self.counters.items()):
+            lines.append(f"{'':9}  {n:6d}  #{name}")
+        return '\n'.join(lines)
+
+
+_tracer: Optional[Tracer] = None
+
+
+def enable(trace_file: Optional[Path] = None) -> Tracer:
+    """ Start tracing (if not already started). The trace is written to trace_file when the process exits. """
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer(trace_file)
+        atexit.register(_finish, _tracer)
+    elif trace_file:
+        _tracer.trace_file = trace_file
+    return _tracer
+
+
+def disable() -> Optional[Tracer]:
+    """ Stop tracing and return the tracer with everything collected so far """
+    global _tracer
+    tracer, _tracer = _tracer, None
+    atexit.unregister(_finish)
+    return tracer
+
+
+def tracer() -> Optional[Tracer]:
+    return _tracer
+
+
+def _finish(tracer: Tracer):
+    if tracer.trace_file:
+        tracer.save(tracer.trace_file)
+        logger.info(f"Trace written to '{tracer.trace_file}'")
+    logger.info(f"Trace summary:\n{tracer.summary()}")
+
+
+def span(name: str, **args):
+    """ Context manager that times the enclosed block as a span, nested in the open span of the same thread
+
+    The yielded args dict can be used to add information that is known only at the end of the block.
+    """
+    return _tracer.span(name, **args) if _tracer else nullcontext(args)
+
+
+def traced(func):
+    """ Decorator that traces every call of func as a span named like the function """
+    name = func.__qualname__
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with span(name):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def inherit(func):
+    """ Returns func so that its spans are nested in the currently open span even if it runs in another thread
+    (e.g. a job of a thread pool)
+    """
+    return _tracer.inherit(func) if _tracer else func
+
+
+def count(name: str, n: int = 1):
+    """ Add n to the counter name (e.g. 'subprocess' or 'fs.symlink') """
+    if _tracer:
+        _tracer.count(name, n)
+
+
+if os.environ.get(TRACE_ENV_VAR):
+    enable(Path(os.environ[TRACE_ENV_VAR]))